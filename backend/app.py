@@ -1,17 +1,53 @@
 import os 
+import re
+import sys
+import math
+import bisect
+import base64
+import binascii
+import gzip
+import zlib
+import functools
+import atexit
+import hashlib
+import time
 import uuid
+import json
+import queue
+import threading
 import datetime
 from datetime import timezone
+import socket
 import sqlite3
 import random # Added for simulation
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from email.utils import parsedate_to_datetime
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, make_response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from pymongo import MongoClient
+from pymongo import MongoClient, CursorType, ReturnDocument, monitoring
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
+from bson import json_util
 from dotenv import load_dotenv
-import google.generativeai as genai
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
 
+try:
+    import orjson
+except ImportError: # Falls back to Flask's stdlib encoder
+    orjson = None
+try:
+    import brotli
+except ImportError: # gzip only
+    brotli = None
+try:
+    import zstandard
+except ImportError: # Archive bundles use gzip
+    zstandard = None
+
 # --------------------------------------------------
 #                App Setup
 # --------------------------------------------------
@@ -19,21 +55,372 @@ app = Flask(__name__)
 CORS(app)
 load_dotenv()
 
+# Number of reverse proxies in front of the app. Only then is X-Forwarded-For believed, and only
+# the entries those proxies appended; by default request.remote_addr is the socket peer.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+if TRUSTED_PROXY_HOPS: app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
+# --------------------------------------------------
+#           REQUEST INSTRUMENTATION
+# --------------------------------------------------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0")) # 0 disables the sampling profiler
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+
+request_metrics = threading.local() # .current: per-request stage totals for the handling thread
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, rendered in Prometheus text format."""
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.setdefault(labels, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def totals(self):
+        # label set -> (sum, count)
+        with self._lock:
+            return {labels: (total, count) for labels, (_, total, count) in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(b), total, count) for labels, (b, total, count) in self._series.items()}
+        for labels, (buckets, total, count) in sorted(series.items()):
+            label_text = prometheus_labels(labels)
+            for bound, n in zip(self.buckets, buckets):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {n}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+def prometheus_labels(labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels)
+
+REQUEST_HISTOGRAMS = {
+    "wall": Histogram("mindmate_request_seconds", "Request wall time", LATENCY_BUCKETS),
+    "mongo": Histogram("mindmate_request_mongo_seconds", "Time spent in MongoDB commands per request", LATENCY_BUCKETS),
+    "mongoOps": Histogram("mindmate_request_mongo_roundtrips", "MongoDB commands issued per request", ROUND_TRIP_BUCKETS),
+    "sqlite": Histogram("mindmate_request_sqlite_seconds", "Time spent in SQLite per request", LATENCY_BUCKETS),
+    "llm": Histogram("mindmate_request_llm_seconds", "Time spent waiting on the model per request", LATENCY_BUCKETS)
+}
+request_counts = Counter() # (route, method, status) -> requests
+request_counts_lock = threading.Lock()
+
+class MongoCommandTimer(monitoring.CommandListener):
+    # pymongo publishes command events on the thread that issued the command
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event.duration_micros)
+
+    def failed(self, event):
+        self._record(event.duration_micros)
+
+    def _record(self, duration_micros):
+        current = getattr(request_metrics, "current", None)
+        if current is None: return
+        current["mongo"] += duration_micros / 1e6
+        current["mongoOps"] += 1
+
+@contextmanager
+def timed_stage(stage):
+    # Adds the block's duration to the current request's `stage` total (no-op outside a request)
+    current = getattr(request_metrics, "current", None)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if current is not None: current[stage] += time.perf_counter() - started
+
+class SamplingProfiler:
+    """Samples the stacks of registered request threads; output is folded stacks ("a;b;c count")."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def start(self, ident):
+        with self._lock:
+            self._threads[ident] = Counter()
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+                self._sampler.start()
+
+    def stop(self, ident):
+        with self._lock:
+            return self._threads.pop(ident, None)
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._threads: continue
+                frames = sys._current_frames()
+                for ident, stacks in self._threads.items():
+                    frame = frames.get(ident)
+                    if frame is not None: stacks[fold_stack(frame)] += 1
+
+def fold_stack(frame):
+    names = []
+    while frame is not None:
+        names.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+def dump_profile(route, wall, stacks):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = re.sub(r"[^\w]+", "_", route).strip("_") or "root"
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%dT%H%M%S')}-{name}-{int(wall * 1000)}ms.folded")
+    with open(path, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    return path
+
+profiler = SamplingProfiler(PROFILE_INTERVAL)
+profiler_settings = {"slowMs": PROFILE_SLOW_MS, "dumps": []}
+
+@app.before_request
+def start_request_metrics():
+    request_metrics.current = {"started": time.perf_counter(), "mongo": 0.0, "mongoOps": 0, "sqlite": 0.0, "llm": 0.0}
+    if profiler_settings["slowMs"]: profiler.start(threading.get_ident())
+
+@app.after_request
+def finish_request_metrics(response):
+    current = getattr(request_metrics, "current", None)
+    if current is None: return response
+    labels = (("route", request.url_rule.rule if request.url_rule else "unmatched"), ("method", request.method))
+    status = response.status_code
+    ident = threading.get_ident()
+
+    def record():
+        # Runs when the body is closed, so streamed responses are timed to their last chunk
+        wall = time.perf_counter() - current["started"]
+        if getattr(request_metrics, "current", None) is current: request_metrics.current = None
+        REQUEST_HISTOGRAMS["wall"].observe(labels, wall)
+        for stage in ("mongo", "mongoOps", "sqlite", "llm"):
+            REQUEST_HISTOGRAMS[stage].observe(labels, current[stage])
+        with request_counts_lock:
+            request_counts[labels + (("status", status),)] += 1
+
+        stacks = profiler.stop(ident)
+        if stacks and wall * 1000 >= profiler_settings["slowMs"]:
+            try:
+                profiler_settings["dumps"] = (profiler_settings["dumps"] + [dump_profile(labels[0][1], wall, stacks)])[-20:]
+            except OSError as e:
+                print("Profile dump error:", e)
+
+    response.call_on_close(record)
+    return response
+
+def prometheus_gauges(prefix, stats):
+    # Flattens a component's stats() dict: {"hitRate": 0.5} -> mindmate_cache_hit_rate 0.5
+    lines = []
+    for key, value in stats.items():
+        name = f"{prefix}_{re.sub(r'(?<!^)(?=[A-Z])', '_', key).lower()}"
+        if isinstance(value, dict):
+            lines.extend(prometheus_gauges(name, value))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines.append(f"{name} {value}")
+    return lines
+
+# --------------------------------------------------
+#     RESPONSE LAYER (JSON, ETAGS, COMPRESSION)
+# --------------------------------------------------
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 5
+COMPRESSIBLE_TYPES = {"application/json", "text/plain", "text/html", "text/csv"}
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask's JSON output (sorted keys, HTTP-date datetimes) produced by orjson."""
+
+    def dumps(self, obj, **kwargs):
+        indent = kwargs.pop("indent", None)
+        kwargs.pop("separators", None) # orjson output is always compact
+        if not kwargs:
+            option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            if indent: option |= orjson.OPT_INDENT_2
+            try:
+                return orjson.dumps(obj, default=self.default, option=option).decode()
+            except orjson.JSONEncodeError:
+                pass # e.g. integers beyond 64 bits; let the stdlib encoder handle (or report) it
+        if indent: kwargs["indent"] = indent
+        return super().dumps(obj, **kwargs)
+
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+def etag_for(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:24]
+
+def conditional(version=None):
+    """ETag/304 support for GET routes.
+
+    With `version(**view_args)` the tag comes from a cheap lookup (update counters, max
+    timestamps) and a match skips the view entirely. Without it the tag hashes the body,
+    which saves bandwidth but not the query.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(*args, **kwargs):
+            tag = None
+            if version is not None:
+                current = version(**kwargs)
+                if current is not None:
+                    tag = etag_for(request.path, request.query_string, current)
+                    if request.if_none_match.contains_weak(tag):
+                        response = Response(status=304)
+                        response.set_etag(tag, weak=True)
+                        response.headers["Cache-Control"] = "no-cache"
+                        return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200: return response
+            response.headers["Cache-Control"] = "no-cache" # Cache, but revalidate every time
+            if tag is not None:
+                response.set_etag(tag, weak=True)
+            elif not response.is_streamed:
+                response.add_etag(weak=True)
+                response.make_conditional(request)
+            return response
+        return wrapped
+    return decorator
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31) # 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        if data: yield data
+    yield compressor.flush()
+
+@app.after_request
+def compress_response(response):
+    if response.status_code != 200 or response.direct_passthrough: return response
+    if response.mimetype not in COMPRESSIBLE_TYPES or "Content-Encoding" in response.headers: return response
+    accepted = request.accept_encodings
+    encoding = "br" if brotli is not None and accepted["br"] else "gzip" if accepted["gzip"] else None
+    if encoding is None: return response
+    response.vary.add("Accept-Encoding")
+
+    if response.is_streamed:
+        # Large streamed bodies (e.g. /admin/users) are compressed chunk by chunk
+        response.response = gzip_stream(response.response)
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers.pop("Content-Length", None)
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES: return response
+    if encoding == "br": data = brotli.compress(data, quality=COMPRESS_LEVEL)
+    else: data = gzip.compress(data, COMPRESS_LEVEL)
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
 # --------------------------------------------------
 #               MongoDB Setup
 # --------------------------------------------------
+db = None
 messages_collection = None
 users_collection = None
 p2p_messages_collection = None
 friend_requests_collection = None
 groups_collection = None
 group_messages_collection = None
+stats_collection = None
+activity_collection = None
+session_summaries_collection = None
+chat_sessions_collection = None
+wellness_series_collection = None
+alerts_collection = None
+conversations_collection = None
+friendships_collection = None
+jobs_collection = None
+
+def index_specs():
+    return [
+        (users_collection, "user_id", {"unique": True}),
+        (users_collection, "email", {"unique": True}),
+        (users_collection, "searchKeys", {}),
+        (friend_requests_collection, "request_id", {"unique": True}),
+        (friend_requests_collection, [("receiver_id", 1), ("status", 1)], {}),
+        (friend_requests_collection, [("sender_id", 1), ("receiver_id", 1), ("status", 1)], {}),
+        (groups_collection, "group_id", {"unique": True}),
+        (groups_collection, "members", {}),
+        (messages_collection, [("session_id", 1), ("user_id", 1), ("timestamp", 1)], {}),
+        (messages_collection, "expiresAt", {"expireAfterSeconds": 0}), # Temporary chats only
+        (p2p_messages_collection, [("sender_id", 1), ("receiver_id", 1), ("timestamp", 1)], {}),
+        (group_messages_collection, [("group_id", 1), ("timestamp", 1), ("message_id", 1)], {}),
+        (chat_sessions_collection, [("user_id", 1), ("session_id", 1)], {"unique": True}),
+        (chat_sessions_collection, [("user_id", 1), ("timestamp", -1)], {}),
+        (chat_sessions_collection, "session_id", {}),
+        (chat_sessions_collection, "timestamp", {}),
+        (chat_sessions_collection, "expiresAt", {"expireAfterSeconds": 0}),
+        (activity_collection, [("granularity", 1), ("start", 1)], {}),
+        (activity_collection, "expiresAt", {"expireAfterSeconds": 0}),
+        (wellness_series_collection, [("user_id", 1), ("count", 1)], {}),
+        (wellness_series_collection, [("user_id", 1), ("end", -1)], {}),
+        (wellness_series_collection, "end", {}),
+        (alerts_collection, "alert_id", {"unique": True}),
+        (alerts_collection, "createdAt", {}),
+        (alerts_collection, [("severity", 1), ("createdAt", -1)], {}),
+        (alerts_collection, [("user_id", 1), ("rule", 1), ("createdAt", -1)], {}),
+        (conversations_collection, [("members", 1), ("timestamp", -1)], {}),
+        (conversations_collection, [("type", 1), ("timestamp", 1)], {}),
+        (friendships_collection, [("user_id", 1), ("friend_id", 1)], {"unique": True})
+    ]
 
-try:
+def ensure_indexes():
+    # Each index is independent: e.g. legacy duplicate emails must not block the rest
+    for collection, keys, options in index_specs():
+        try:
+            collection.create_index(keys, **options)
+        except Exception as e:
+            print(f"❌ Index creation error on {collection.name} {keys}:", e)
+
+# Pool sized for one worker process; total connections = workers x MONGO_MAX_POOL_SIZE
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+    "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_MS", "60000")),
+    "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000")),
+    "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+    "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000")),
+    "appname": "mindmate"
+}
+mongo_client = None
+
+def init_mongo():
+    # MongoClient starts monitor threads and opens sockets lazily, so it must be created after fork
+    global mongo_client, db, messages_collection, users_collection, p2p_messages_collection
+    global friend_requests_collection, groups_collection, group_messages_collection, stats_collection
+    global activity_collection, session_summaries_collection, chat_sessions_collection
+    global wellness_series_collection, alerts_collection, conversations_collection, friendships_collection
+    global jobs_collection
     mongo_uri = os.getenv("MONGO_URI")
-    if mongo_uri:
-        client = MongoClient(mongo_uri)
-        db = client["aura_ai"]
+    if not mongo_uri:
+        print("⚠️ MONGO_URI not found in environment variables")
+        return
+    try:
+        mongo_client = MongoClient(mongo_uri, event_listeners=[MongoCommandTimer()], **MONGO_CLIENT_OPTIONS)
+        db = mongo_client["aura_ai"]
         messages_collection = db["messages"] # AI Chat
         users_collection = db["users"]#user profiles 
         p2p_messages_collection = db["p2p_messages"] # User-to-User Chat
@@ -42,72 +429,676 @@ try:
         # --- NEW GROUP COLLECTIONS ---
         groups_collection = db["groups"] 
         group_messages_collection = db["group_messages"]
-        
-        print("✅ MongoDB connected")
-    else:
-        print("⚠️ MONGO_URI not found in environment variables")
-except Exception as e:
-    print("❌ MongoDB error:", e)
+
+        # --- PRECOMPUTED ADMIN STATS ---
+        stats_collection = db["stats"] # Running counters
+        activity_collection = db["activity_rollups"] # Hourly/daily active sessions
+        session_summaries_collection = db["session_summaries"] # Rolling AI context summaries
+        chat_sessions_collection = db["chat_sessions"] # Per-session sidebar summaries
+        wellness_series_collection = db["wellness_series"] # Bucketed wellness check-in history
+        alerts_collection = db["alerts"] # High-risk alerts raised on write
+        conversations_collection = db["conversations"] # Inbox: last message + unread counts per chat
+        friendships_collection = db["friendships"] # Friend graph: one edge per direction
+        jobs_collection = db["jobs"] # Background job leases, shared by every worker and host
+    except Exception as e:
+        print("❌ MongoDB error:", e)
+
+# --------------------------------------------------
+#           BUFFERED MESSAGE WRITES
+# --------------------------------------------------
+class BufferedWriter:
+    """Batches inserts per collection into insert_many(ordered=False), flushed on size or time.
+
+    Unbuffered (the default) it writes immediately, still batching the docs of one call.
+    """
+
+    def __init__(self, buffered=False, max_batch=200, flush_interval=0.2):
+        self.buffered = buffered
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def insert(self, collection, docs):
+        if not docs: return
+        if not self.buffered:
+            self._write(collection, docs)
+            return
+        with self._lock:
+            if self._flusher is None: # Started on first use so it belongs to the worker process
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self._flusher.start()
+            pending = self._buffers.setdefault(collection.full_name, (collection, []))[1]
+            pending.extend(docs)
+            full = len(pending) >= self.max_batch
+        if full: self.flush()
+
+    def _write(self, collection, docs):
+        if len(docs) == 1: collection.insert_one(docs[0])
+        else: collection.insert_many(docs, ordered=False)
+
+    def flush(self):
+        with self._lock:
+            buffers, self._buffers = self._buffers, {}
+        for collection, docs in buffers.values():
+            try:
+                self._write(collection, docs)
+            except Exception as e:
+                print(f"❌ Buffered write to {collection.name} failed ({len(docs)} docs):", e)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+# MESSAGE_WRITE_MODE=buffered trades a flush interval of read-after-write lag for fewer round-trips
+message_writer = BufferedWriter(buffered=os.getenv("MESSAGE_WRITE_MODE") == "buffered")
+atexit.register(message_writer.flush) # Gunicorn/Flask shutdown drains pending chat messages
 
 # --------------------------------------------------
 #               Gemini Setup
 # --------------------------------------------------
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+GEMINI_MODEL_NAME = "gemini-2.5-flash"
+genai = None
+genai_lock = threading.Lock()
+
+# GEMINI_FAKE_MODEL=1 swaps in a local stand-in (no network) for tests and load runs
+FAKE_MODEL = os.getenv("GEMINI_FAKE_MODEL") == "1"
+FAKE_MODEL_LATENCY = float(os.getenv("GEMINI_FAKE_LATENCY", "0.5"))
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeChatSession:
+    """Mimics a Gemini chat session: echoes the message after FAKE_MODEL_LATENCY seconds."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def send_message(self, message, *, stream=False): # Keyword-only, like the real SDK
+        words = f"I hear you. You said: {message}".split(" ")
+        chunks = [w + " " for w in words[:-1]] + words[-1:]
+        if stream: return self._stream(chunks)
+        time.sleep(self.latency)
+        return FakeResponse("".join(chunks))
+
+    def _stream(self, chunks):
+        for chunk in chunks:
+            time.sleep(self.latency / len(chunks))
+            yield FakeResponse(chunk)
+
+class FakeModel:
+    def __init__(self, system_instruction=None, latency=None):
+        self.system_instruction = system_instruction
+        self.latency = FAKE_MODEL_LATENCY if latency is None else latency
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self.latency)
+
+    def generate_content(self, prompt):
+        time.sleep(self.latency)
+        return FakeResponse(prompt[-200:])
+
+def init_gemini():
+    # Deferred: importing the SDK dominates worker boot, and its channels should not cross a fork
+    global genai
+    if FAKE_MODEL or genai is not None: return
+    with genai_lock:
+        if genai is not None: return
+        import google.generativeai as sdk
+        sdk.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        genai = sdk
+
+def make_model(system_instruction):
+    if FAKE_MODEL: return FakeModel(system_instruction)
+    init_gemini()
+    return genai.GenerativeModel(GEMINI_MODEL_NAME, system_instruction=system_instruction)
 
 # --------------------------------------------------
-#           SQLite (AI MEMORY ONLY)
+#        LLM EXECUTOR (ADMISSION CONTROL)
 # --------------------------------------------------
-def get_sqlite_connection():
-    conn = sqlite3.connect("aura_memory.db", check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_memory_db():
-    conn = get_sqlite_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_memory (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT,
-            memory_key TEXT,
-            memory_value TEXT,
-            importance INTEGER,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    conn.commit()
-    conn.close()
+# Keep LLM_MAX_CONCURRENCY + LLM_MAX_QUEUE below the server's thread count so that
+# slow model calls can never hold every request thread.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "16"))
+LLM_MAX_PER_USER = int(os.getenv("LLM_MAX_PER_USER", "2"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+
+class LLMRejected(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class LLMAdmission:
+    """A reserved slot; released when the model call finishes, or on exit if it never started."""
+
+    def __init__(self, executor, user_id):
+        self.executor = executor
+        self.user_id = user_id
+        self.handed_off = False
+        self._released = False
+
+    def release(self):
+        if self._released: return
+        self._released = True
+        self.executor._release(self.user_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if not self.handed_off: self.release()
+
+class LLMExecutor:
+    """Runs model calls on a bounded pool with admission control, timeouts and queue metrics."""
+
+    def __init__(self, max_workers, max_queue, max_per_user, timeout):
+        self.max_workers = max_workers
+        self.capacity = max_workers + max_queue
+        self.max_per_user = max_per_user
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._running = 0
+        self._per_user = {}
+        self.counters = {
+            "completed": 0, "failed": 0, "timeouts": 0, "rejectedBusy": 0, "rejectedUser": 0,
+            "waitSecondsTotal": 0.0, "callSecondsTotal": 0.0
+        }
 
-init_memory_db()
+    def admit(self, user_id=None):
+        with self._lock:
+            if self._admitted >= self.capacity:
+                self.counters["rejectedBusy"] += 1
+                raise LLMRejected(503, "Aura is busy right now, please try again in a moment")
+            if user_id and self._per_user.get(user_id, 0) >= self.max_per_user:
+                self.counters["rejectedUser"] += 1
+                raise LLMRejected(429, "Please wait for Aura to finish replying")
+            self._admitted += 1
+            if user_id: self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        return LLMAdmission(self, user_id)
+
+    def _release(self, user_id):
+        with self._lock:
+            self._admitted -= 1
+            if user_id:
+                remaining = self._per_user.get(user_id, 1) - 1
+                if remaining: self._per_user[user_id] = remaining
+                else: self._per_user.pop(user_id, None)
+
+    def _timed(self, queued_at, fn, *args):
+        started = time.monotonic()
+        with self._lock:
+            self._running += 1
+            self.counters["waitSecondsTotal"] += started - queued_at
+        ok = False
+        try:
+            result = fn(*args)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self._running -= 1
+                self.counters["completed" if ok else "failed"] += 1
+                self.counters["callSecondsTotal"] += time.monotonic() - started
+
+    def submit(self, admission, fn, *args):
+        admission.handed_off = True
+        future = self._pool.submit(self._timed, time.monotonic(), fn, *args)
+        future.add_done_callback(lambda _: admission.release())
+        return future
+
+    def run(self, admission, fn, *args):
+        future = self.submit(admission, fn, *args)
+        try:
+            with timed_stage("llm"):
+                return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock: self.counters["timeouts"] += 1
+            raise LLMRejected(504, "Aura took too long to respond, please try again")
+
+    def stream(self, admission, fn, *args):
+        # fn returns an iterable (a streaming model response); chunks are relayed through a queue
+        chunks = queue.Queue()
+        done = object()
+
+        def produce():
+            try:
+                for chunk in fn(*args):
+                    chunks.put(chunk)
+            except Exception as e:
+                chunks.put(e)
+            finally:
+                chunks.put(done)
+
+        self.submit(admission, produce)
+        deadline = time.monotonic() + self.timeout
+
+        def relay():
+            while True:
+                try:
+                    with timed_stage("llm"):
+                        item = chunks.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    with self._lock: self.counters["timeouts"] += 1
+                    raise LLMRejected(504, "Aura took too long to respond, please try again")
+                if item is done: return
+                if isinstance(item, Exception): raise item
+                yield item
+
+        return relay()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update({
+                "running": self._running, "queued": max(self._admitted - self._running, 0),
+                "admitted": self._admitted, "capacity": self.capacity, "maxConcurrency": self.max_workers
+            })
+        return stats
+
+llm_executor = LLMExecutor(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_MAX_PER_USER, LLM_TIMEOUT_SECONDS)
+
+def llm_rejection(error):
+    response = jsonify({"error": error.message})
+    response.status_code = error.status
+    if error.status in (429, 503): response.headers["Retry-After"] = "5"
+    return response
+
+# --------------------------------------------------
+#               IN-PROCESS CACHES
+# --------------------------------------------------
+class TTLCache:
+    """Thread-safe LRU cache; entries also expire after `ttl` seconds when set."""
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] is not None and item[1] < time.monotonic():
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[0] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits,
+                "misses": self.misses, "hitRate": round(self.hits / total, 3) if total else 0}
+
+# --------------------------------------------------
+#       RATE LIMITING & REQUEST COALESCING
+# --------------------------------------------------
+def parse_rate(name, default):
+    # RATE_LIMIT_<NAME>="burst/per_minute", e.g. "10/20"; "0" turns that limit off
+    value = os.getenv(f"RATE_LIMIT_{name.upper()}", default)
+    if value.strip() == "0": return None
+    burst, per_minute = value.split("/")
+    return int(burst), float(per_minute) / 60
+
+RATE_LIMITS = {
+    "chat": parse_rate("chat", "10/20"), # Model calls, per user
+    "emotion": parse_rate("emotion", "10/30"), # Camera frames arrive every 3s per open chat
+    "search": parse_rate("search", "20/60"), # One request per (debounced) keystroke
+    "admin": parse_rate("admin", "20/60") # Dashboard aggregations, per client address
+}
+# A request naming a user is also limited per client address, at this multiple of the per-user rate
+# (user ids are not authenticated, and several users may share one address)
+RATE_LIMIT_ADDRESS_FACTOR = float(os.getenv("RATE_LIMIT_ADDRESS_FACTOR", "4"))
+
+class LocalBucketStore:
+    """Token buckets for this worker only; the effective limit is multiplied by the worker count."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, burst, rate):
+        # Returns (allowed, seconds until the next token)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed: tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+class MongoBucketStore:
+    """Buckets shared by every worker: compare-and-swap on one document per key, idle ones expire."""
+
+    def __init__(self, database, name="rate_limits", retries=3):
+        self._buckets = database[name]
+        self._buckets.create_index("expiresAt", expireAfterSeconds=0)
+        self.retries = retries
+
+    def take(self, key, burst, rate):
+        for _ in range(self.retries):
+            now = time.time()
+            doc = self._buckets.find_one({"_id": key})
+            tokens = burst if doc is None else min(burst, doc["tokens"] + (now - doc["updated"]) * rate)
+            allowed = tokens >= 1
+            if allowed: tokens -= 1
+            fields = {"tokens": tokens, "updated": now,
+                      "expiresAt": datetime.datetime.now(timezone.utc) + datetime.timedelta(seconds=burst / rate + 60)}
+            if doc is None:
+                try:
+                    self._buckets.insert_one(dict(fields, _id=key))
+                except DuplicateKeyError:
+                    continue
+            elif self._buckets.update_one({"_id": key, "updated": doc["updated"]}, {"$set": fields}).modified_count != 1:
+                continue # Another worker took a token in between; re-read
+            return allowed, 0 if allowed else (1 - tokens) / rate
+        return True, 0 # Heavy contention on one key: let it through rather than stall the request
+
+def create_rate_limit_store():
+    if os.getenv("RATE_LIMIT_STORE") == "mongo" and db is not None:
+        return MongoBucketStore(db)
+    return LocalBucketStore()
+
+class RateLimiter:
+    def __init__(self, store):
+        self.store = store # Swapped for the configured store by init_shared_stores()
+        self.counters = {name: Counter() for name in RATE_LIMITS}
+        self._lock = threading.Lock()
+
+    def take(self, name, identities):
+        # identities: (identity, scale) pairs; the request needs a token from every bucket
+        burst, rate = RATE_LIMITS[name]
+        allowed, retry_after = True, 0
+        for identity, scale in identities:
+            try:
+                allowed, retry_after = self.store.take(f"{name}:{identity}", burst * scale, rate * scale)
+            except Exception as e:
+                print("Rate limit store error:", e)
+                allowed, retry_after = True, 0 # Fail open: the limiter must not take the API down
+            if not allowed: break
+        with self._lock:
+            self.counters[name]["allowed" if allowed else "rejected"] += 1
+        return allowed, retry_after
+
+    def stats(self):
+        with self._lock:
+            stats = {name: dict(counter) for name, counter in self.counters.items()}
+        stats["store"] = type(self.store).__name__
+        return stats
+
+rate_limiter = RateLimiter(LocalBucketStore())
+
+# Sent for every anonymous visitor (temp-chat.html, Chat-bot.html, the /chat default), so they
+# name nobody in particular: such requests are limited per address only
+PLACEHOLDER_USER_IDS = {"Guest", "guest", "user_1"}
+
+def client_address():
+    return f"ip:{request.remote_addr}"
+
+def client_identities():
+    # Per user where the request names one, and always per client address (see TRUSTED_PROXY_HOPS):
+    # the user id comes from the request, so a fresh one per call must not mean a fresh bucket
+    address = client_address()
+    data = request.get_json(silent=True) if request.is_json else None
+    user_id = data.get("user_id") if isinstance(data, dict) else None
+    user_id = user_id or request.args.get("user_id") or (request.view_args or {}).get("user_id")
+    if not user_id or user_id in PLACEHOLDER_USER_IDS: return [(address, 1)]
+    return [(f"user:{user_id}", 1), (address, RATE_LIMIT_ADDRESS_FACTOR)]
+
+def rate_limited(name):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if RATE_LIMITS.get(name):
+                allowed, retry_after = rate_limiter.take(name, client_identities())
+                if not allowed:
+                    response = jsonify({"error": "Too many requests, please slow down"})
+                    response.status_code = 429
+                    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+                    return response
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class SingleFlight:
+    """Concurrent calls with the same key wait for the first one and share its result."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.counters = {}
+
+    def do(self, name, key, fn):
+        with self._lock:
+            counters = self.counters.setdefault(name, Counter())
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                counters["computed"] += 1
+            else:
+                counters["coalesced"] += 1
+        if not leader: return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            stats = {name: dict(counter) for name, counter in self.counters.items()}
+            stats["inFlight"] = len(self._calls)
+        return stats
+
+single_flight = SingleFlight()
+
+def coalesced(view):
+    # Identical requests (same path and query) arriving while one is being computed get a copy
+    # of its response; each caller still gets its own Response for the after_request hooks
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        def render():
+            response = app.make_response(view(*args, **kwargs))
+            return response.get_data(), response.status_code, list(response.headers.items())
+        body, status, headers = single_flight.do(request.endpoint, request.full_path, render)
+        return app.response_class(body, status, headers)
+    return wrapper
+
+# --------------------------------------------------
+#           SQLite (AI MEMORY ONLY)
+# --------------------------------------------------
+MEMORY_UPSERT_SQL = """
+    INSERT INTO user_memory (user_id, memory_key, memory_value, importance)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(user_id, memory_key) DO UPDATE SET
+        memory_value = excluded.memory_value,
+        importance = excluded.importance,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+class MemoryStore:
+    """SQLite AI memory with pooled WAL connections and an optional write-behind queue."""
+
+    def __init__(self, path, pool_size=8, write_behind=False, batch_size=50, flush_interval=0.5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_write = None # Called with the affected user_ids after each commit
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._pending = queue.Queue() if write_behind else None
+        self._write_lock = threading.Lock()
+        self._init_schema()
+        if write_behind:
+            threading.Thread(target=self._write_behind_loop, daemon=True).start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _release(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _init_schema(self):
+        conn = self._acquire()
+        try:
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS user_memory (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id TEXT,
+                        memory_key TEXT,
+                        memory_value TEXT,
+                        importance INTEGER,
+                        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                has_unique = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_user_memory_key'"
+                ).fetchone()
+                if not has_unique:
+                    # Older databases may hold duplicate keys; keep the newest row of each
+                    conn.execute("""
+                        DELETE FROM user_memory WHERE id NOT IN (
+                            SELECT MAX(id) FROM user_memory GROUP BY user_id, memory_key
+                        )
+                    """)
+                    conn.execute("CREATE UNIQUE INDEX idx_user_memory_key ON user_memory (user_id, memory_key)")
+                # Covers the ranked read in get() without touching the table
+                conn.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_user_memory_rank ON user_memory
+                    (user_id, importance DESC, updated_at DESC, memory_key, memory_value)
+                """)
+        finally:
+            self._release(conn)
+
+    def get(self, user_id, limit=5):
+        conn = self._acquire()
+        try:
+            with timed_stage("sqlite"):
+                rows = conn.execute("""
+                    SELECT memory_key, memory_value
+                    FROM user_memory
+                    WHERE user_id = ?
+                    ORDER BY importance DESC, updated_at DESC
+                    LIMIT ?
+                """, (user_id, limit)).fetchall()
+        finally:
+            self._release(conn)
+        return {row["memory_key"]: row["memory_value"] for row in rows}
+
+    def save(self, user_id, key, value, importance=5):
+        row = (user_id, key, value, importance)
+        if self._pending is not None:
+            self._pending.put(row)
+        else:
+            self._write([row])
+
+    def _write(self, rows):
+        conn = self._acquire()
+        try:
+            with timed_stage("sqlite"), self._write_lock, conn:
+                conn.executemany(MEMORY_UPSERT_SQL, rows)
+        finally:
+            self._release(conn)
+        if self.on_write: self.on_write([row[0] for row in rows])
+
+    def _drain(self, first=None):
+        rows = [first] if first is not None else []
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _write_behind_loop(self):
+        while True:
+            first = self._pending.get()
+            time.sleep(self.flush_interval) # Let a batch accumulate
+            rows = self._drain(first)
+            try:
+                self._write(rows)
+            except Exception as e:
+                print("Memory write-behind error:", e)
+
+    def flush(self):
+        # Called on shutdown so queued memory updates are not lost
+        if self._pending is None: return
+        rows = self._drain()
+        while rows:
+            self._write(rows)
+            rows = self._drain()
+
+memory_store = None
+
+def init_memory_store():
+    # SQLite connections must not be shared across fork; each worker opens its own pool
+    global memory_store
+    memory_store = MemoryStore(
+        os.getenv("MEMORY_DB_PATH", "aura_memory.db"),
+        write_behind=os.getenv("MEMORY_WRITE_BEHIND") == "1"
+    )
+    memory_store.on_write = bump_memory_version
+    atexit.register(memory_store.flush)
 
 # --------------------------------------------------
 #               Memory Helpers
 # --------------------------------------------------
 def get_user_memory(user_id, limit=5):
-    conn = get_sqlite_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT memory_key, memory_value
-        FROM user_memory
-        WHERE user_id = ?
-        ORDER BY importance DESC, updated_at DESC
-        LIMIT ?
-    """, (user_id, limit))
-    rows = cursor.fetchall()
-    conn.close()
-    return {row["memory_key"]: row["memory_value"] for row in rows}
+    return memory_store.get(user_id, limit)
 
 def save_or_update_memory(user_id, key, value, importance=5):
-    conn = get_sqlite_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM user_memory WHERE user_id = ? AND memory_key = ?", (user_id, key))
-    existing = cursor.fetchone()
-    if existing:
-        cursor.execute("UPDATE user_memory SET memory_value = ?, importance = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?", (value, importance, existing["id"]))
-    else:
-        cursor.execute("INSERT INTO user_memory (user_id, memory_key, memory_value, importance) VALUES (?, ?, ?, ?)", (user_id, key, value, importance))
-    conn.commit()
-    conn.close()
+    memory_store.save(user_id, key, value, importance)
 
 # --------------------------------------------------
 #               AI Persona
@@ -125,15 +1116,1254 @@ def get_ai_persona(user_memory):
         "User background:\n" + memory_block
     )
 
-def get_chat_history(session_id, user_id):
+# --------------------------------------------------
+#           PERSONA / MODEL CACHE
+# --------------------------------------------------
+persona_cache = TTLCache(maxsize=int(os.getenv("PERSONA_CACHE_SIZE", "2000")), ttl=300)
+memory_versions = {}
+memory_versions_lock = threading.Lock()
+
+def bump_memory_version(user_ids):
+    with memory_versions_lock:
+        for user_id in set(user_ids):
+            memory_versions[user_id] = memory_versions.get(user_id, 0) + 1
+
+def get_persona_model(user_id):
+    # Rendered persona + model are reused until this user's memory changes
+    key = (user_id, memory_versions.get(user_id, 0))
+    cached = persona_cache.get(key)
+    if cached is not None: return cached
+    persona = get_ai_persona(get_user_memory(user_id))
+    cached = (persona, make_model(persona))
+    persona_cache.set(key, cached)
+    return cached
+
+# --------------------------------------------------
+#           MESSAGE PAGINATION HELPERS
+# --------------------------------------------------
+MAX_PAGE_SIZE = 500
+
+def parse_page_size(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return MAX_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def parse_bounded_int(value, default, low, high=None):
+    # Client-supplied numbers: anything unparsable falls back to the default instead of a 500
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return default
+    number = max(low, number)
+    return min(number, high) if high is not None else number
+
+def parse_cursor_time(value, as_datetime):
+    # P2P/group timestamps are stored as ISO strings, AI messages as datetimes
+    if not value or not as_datetime: return value
+    try:
+        return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (TypeError, ValueError, AttributeError):
+        pass
+    try:
+        return parsedate_to_datetime(value) # Cursors from before timestamps were ISO (HTTP dates)
+    except (TypeError, ValueError):
+        return None # Unparseable cursor: ignored, like a bad limit
+
+def cursor_timestamp(value):
+    # Mongo keeps datetimes to the millisecond; anything coarser (e.g. jsonify's HTTP dates) is not a usable cursor
+    if not isinstance(value, datetime.datetime): return value
+    if value.tzinfo is None: value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat(timespec="milliseconds")
+
+def cursor_clause(timestamp, message_id, op):
+    if not message_id: return {"timestamp": {op: timestamp}}
+    return {"$or": [{"timestamp": {op: timestamp}}, {"timestamp": timestamp, "message_id": {op: message_id}}]}
+
+def paginate_messages(collection, base_query, params, timestamps_are_datetimes=False):
+    """Return one page in ascending order.
+
+    `since`/`since_id` fetches messages after a cursor (oldest first), `before`/`before_id`
+    pages backwards, and with neither the newest `limit` messages are returned.
+    """
+    limit = parse_page_size(params.get("limit"))
+    since = parse_cursor_time(params.get("since"), timestamps_are_datetimes)
+    before = parse_cursor_time(params.get("before"), timestamps_are_datetimes)
+
+    clauses = [base_query]
+    if since: clauses.append(cursor_clause(since, params.get("since_id"), "$gt"))
+    if before: clauses.append(cursor_clause(before, params.get("before_id"), "$lt"))
+    query = clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    if since:
+        return list(collection.find(query, {"_id": 0}).sort([("timestamp", 1), ("message_id", 1)]).limit(limit))
+    page = list(collection.find(query, {"_id": 0}).sort([("timestamp", -1), ("message_id", -1)]).limit(limit))
+    page.reverse()
+    return page
+    
+# --------------------------------------------------
+#        AI CONTEXT ASSEMBLY (ROLLING SUMMARY)
+# --------------------------------------------------
+CONTEXT_RECENT_MESSAGES = int(os.getenv("CONTEXT_RECENT_MESSAGES", "12"))
+SUMMARY_REFRESH_EVERY = int(os.getenv("SUMMARY_REFRESH_EVERY", "10"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+MAX_UNSUMMARIZED_MESSAGES = 200
+SUMMARY_MAX_CHARS = 2000
+SUMMARY_INSTRUCTION = (
+    "You keep a short running summary of a supportive mental health conversation between a student and Aura AI. "
+    "Keep what the assistant will need later: feelings, events, people, plans. Plain prose, under 150 words."
+)
+
+summary_cache = TTLCache(maxsize=5000, ttl=600)
+summaries_in_flight = set()
+summaries_lock = threading.Lock()
+summary_model = None
+context_metrics = {
+    "turns": 0, "promptTokensTotal": 0, "promptTokensMax": 0, "historyMessagesTotal": 0,
+    "turnsWithSummary": 0, "summaryRefreshes": 0, "summaryFailures": 0
+}
+context_metrics_lock = threading.Lock()
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1 # ~4 characters per token is close enough for budgeting
+
+def summary_key(user_id, session_id):
+    return f"{user_id}:{session_id}"
+
+def load_summary(user_id, session_id):
+    key = summary_key(user_id, session_id)
+    doc = summary_cache.get(key)
+    if doc is None:
+        doc = {}
+        if session_summaries_collection is not None:
+            doc = session_summaries_collection.find_one({"_id": key}) or {}
+        summary_cache.set(key, doc)
+    return doc
+
+def fetch_unsummarized(user_id, session_id, summary_doc):
+    query = {"session_id": session_id, "user_id": user_id}
+    if summary_doc.get("until_ts"):
+        query = {"$and": [query, cursor_clause(summary_doc["until_ts"], summary_doc.get("until_id"), "$gt")]}
+    docs = list(messages_collection.find(
+        query, {"_id": 0, "message_id": 1, "sender": 1, "message": 1, "timestamp": 1}
+    ).sort([("timestamp", -1), ("message_id", -1)]).limit(MAX_UNSUMMARIZED_MESSAGES))
+    docs.reverse()
+    return docs
+
+def refresh_summary(user_id, session_id, summary_doc, docs):
+    global summary_model
+    key = summary_key(user_id, session_id)
+    try:
+        if summary_model is None: summary_model = make_model(SUMMARY_INSTRUCTION)
+        transcript = "\n".join(f"{'Student' if d['sender'] == 'user' else 'Aura'}: {d['message']}" for d in docs)
+        prompt = (
+            f"Current summary:\n{summary_doc.get('summary') or '(none yet)'}\n\n"
+            f"New messages:\n{transcript}\n\nWrite the updated summary."
+        )
+        summary = summary_model.generate_content(prompt).text.strip()[:SUMMARY_MAX_CHARS]
+        updated = {
+            "_id": key, "user_id": user_id, "session_id": session_id, "summary": summary,
+            "until_ts": docs[-1]["timestamp"], "until_id": docs[-1].get("message_id"),
+            "folded": summary_doc.get("folded", 0) + len(docs),
+            "updated_at": datetime.datetime.now(timezone.utc)
+        }
+        if session_summaries_collection is not None:
+            session_summaries_collection.replace_one({"_id": key}, updated, upsert=True)
+        summary_cache.set(key, updated)
+        with context_metrics_lock: context_metrics["summaryRefreshes"] += 1
+    except Exception as e:
+        print("Summary refresh error:", e)
+        with context_metrics_lock: context_metrics["summaryFailures"] += 1
+    finally:
+        with summaries_lock: summaries_in_flight.discard(key)
+
+def schedule_summary_refresh(user_id, session_id, summary_doc, docs):
+    # Folding runs off the request path; until it lands the turns stay verbatim (within budget)
+    key = summary_key(user_id, session_id)
+    with summaries_lock:
+        if key in summaries_in_flight: return
+        summaries_in_flight.add(key)
+    try:
+        with llm_executor.admit() as admission:
+            llm_executor.submit(admission, refresh_summary, user_id, session_id, summary_doc, docs)
+    except LLMRejected:
+        with summaries_lock: summaries_in_flight.discard(key) # Busy; retried on a later turn
+
+def assemble_context(user_id, session_id, pending_message):
+    """Build model history: rolling summary + recent turns verbatim, trimmed to the token budget."""
     if messages_collection is None: return []
-    cursor = messages_collection.find({"session_id": session_id, "user_id": user_id}).sort("timestamp", 1)
+    summary_doc = load_summary(user_id, session_id)
+    docs = fetch_unsummarized(user_id, session_id, summary_doc)
+
+    older = docs[:-CONTEXT_RECENT_MESSAGES] if len(docs) > CONTEXT_RECENT_MESSAGES else []
+    if len(older) >= SUMMARY_REFRESH_EVERY:
+        schedule_summary_refresh(user_id, session_id, summary_doc, older)
+
+    summary = summary_doc.get("summary", "")
+    budget = CONTEXT_TOKEN_BUDGET - estimate_tokens(pending_message) - (estimate_tokens(summary) if summary else 0)
+    kept, used = [], 0
+    for doc in reversed(docs):
+        tokens = estimate_tokens(doc["message"])
+        if used + tokens > budget: break
+        kept.append(doc)
+        used += tokens
+    kept.reverse()
+    while kept and kept[0]["sender"] != "user": kept.pop(0) # History must open with a user turn
+
     history = []
-    for doc in cursor:
-        role = "user" if doc["sender"] == "user" else "model"
-        history.append({"role": role, "parts": [doc["message"]]})
+    if summary:
+        history.append({"role": "user", "parts": [f"[Summary of our earlier conversation: {summary}]"]})
+        history.append({"role": "model", "parts": ["Thank you, I remember that."]})
+    for doc in kept:
+        history.append({"role": "user" if doc["sender"] == "user" else "model", "parts": [doc["message"]]})
+
+    prompt_tokens = CONTEXT_TOKEN_BUDGET - budget + used
+    with context_metrics_lock:
+        context_metrics["turns"] += 1
+        context_metrics["promptTokensTotal"] += prompt_tokens
+        context_metrics["promptTokensMax"] = max(context_metrics["promptTokensMax"], prompt_tokens)
+        context_metrics["historyMessagesTotal"] += len(kept)
+        if summary: context_metrics["turnsWithSummary"] += 1
     return history
-    
+
+def get_context_metrics():
+    with context_metrics_lock:
+        metrics = dict(context_metrics)
+    turns = metrics["turns"]
+    metrics["promptTokensAvg"] = round(metrics["promptTokensTotal"] / turns, 1) if turns else 0
+    metrics["summaryCache"] = summary_cache.stats()
+    return metrics
+
+# --------------------------------------------------
+#           CHAT SESSION SUMMARIES
+# --------------------------------------------------
+def touch_chat_session(user_id, session_id, last_message, timestamp, added, expires_at=None):
+    if chat_sessions_collection is None: return
+    fields = {"last_message": last_message, "timestamp": timestamp}
+    if expires_at: fields["expiresAt"] = expires_at
+    result = chat_sessions_collection.update_one(
+        {"user_id": user_id, "session_id": session_id},
+        {
+            "$set": fields,
+            "$inc": {"message_count": added},
+            "$setOnInsert": {"created_at": timestamp}
+        },
+        upsert=True
+    )
+    if result.upserted_id is not None: bump_stats({"sessionsVersion": 1}) # Admin session counts changed
+
+def backfill_chat_sessions():
+    # One-off: build summaries for sessions that predate the chat_sessions collection
+    try:
+        if backfill_completed("backfill_chat_sessions"): return
+        pipeline = [
+            {"$sort": {"timestamp": 1}},
+            {"$group": {
+                "_id": {"user_id": "$user_id", "session_id": "$session_id"},
+                "last_message": {"$last": "$message"}, "timestamp": {"$last": "$timestamp"},
+                "created_at": {"$first": "$timestamp"}, "message_count": {"$sum": 1}
+            }}
+        ]
+        for row in messages_collection.aggregate(pipeline, allowDiskUse=True):
+            chat_sessions_collection.update_one(
+                {"user_id": row["_id"]["user_id"], "session_id": row["_id"]["session_id"]},
+                {"$setOnInsert": {
+                    "last_message": row["last_message"], "timestamp": row["timestamp"],
+                    "created_at": row["created_at"], "message_count": row["message_count"]
+                }},
+                upsert=True
+            )
+        mark_backfill_completed("backfill_chat_sessions")
+    except Exception as e:
+        print("Chat session backfill error:", e)
+
+# --------------------------------------------------
+#        ADMIN STATISTICS (MATERIALIZED)
+# --------------------------------------------------
+STATS_DOC_ID = "global"
+STATS_RECONCILE_SECONDS = int(os.getenv("STATS_RECONCILE_SECONDS", "900"))
+HOURLY_ROLLUP_RETENTION = datetime.timedelta(days=7)
+REPORT_WEEKS = 5
+
+def score_counters(score, sign):
+    # Counter deltas contributed by one user's wellness score (sign=-1 removes it)
+    if not isinstance(score, (int, float)): return {}
+    return {
+        "scoredUsers": sign, "scoreSum": sign * score,
+        "highRisk": sign if score < 50 else 0,
+        "positiveUsers": sign if score >= 75 else 0
+    }
+
+def bump_stats(*deltas):
+    if stats_collection is None: return
+    inc = {}
+    for delta in deltas:
+        for key, value in delta.items():
+            inc[key] = inc.get(key, 0) + value
+    inc = {k: v for k, v in inc.items() if v}
+    if inc:
+        stats_collection.update_one({"_id": STATS_DOC_ID}, {"$inc": inc}, upsert=True)
+
+def rollup_keys(now):
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    day = hour.replace(hour=0)
+    return hour, day, f"hour:{hour:%Y-%m-%dT%H}", f"day:{day:%Y-%m-%d}"
+
+def record_activity(session_id):
+    if activity_collection is None: return
+    hour, day, hour_key, day_key = rollup_keys(datetime.datetime.now(timezone.utc))
+    activity_collection.update_one({"_id": hour_key}, {
+        "$addToSet": {"sessions": session_id},
+        "$setOnInsert": {"granularity": "hour", "start": hour, "expiresAt": hour + HOURLY_ROLLUP_RETENTION}
+    }, upsert=True)
+    activity_collection.update_one({"_id": day_key}, {
+        "$addToSet": {"sessions": session_id},
+        "$setOnInsert": {"granularity": "day", "start": day}
+    }, upsert=True)
+
+def record_checkin(score):
+    if activity_collection is None or not isinstance(score, (int, float)): return
+    _, day, _, day_key = rollup_keys(datetime.datetime.now(timezone.utc))
+    activity_collection.update_one({"_id": day_key}, {
+        "$inc": {"checkins": 1, "scoreSum": score},
+        "$setOnInsert": {"granularity": "day", "start": day}
+    }, upsert=True)
+
+def active_sessions_since(start, granularity="hour"):
+    if activity_collection is None: return 0
+    bucket_start = start.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day": bucket_start = bucket_start.replace(hour=0)
+    sessions = set()
+    for bucket in activity_collection.find({"granularity": granularity, "start": {"$gte": bucket_start}}, {"sessions": 1}):
+        sessions.update(bucket.get("sessions", []))
+    return len(sessions)
+
+def reconcile_stats():
+    # Full recount, used to seed the counters and to correct drift from concurrent writes
+    pipeline = [
+        {"$match": {"wellnessProfile.score": {"$type": "number"}}},
+        {"$group": {
+            "_id": None,
+            "scoredUsers": {"$sum": 1},
+            "scoreSum": {"$sum": "$wellnessProfile.score"},
+            "highRisk": {"$sum": {"$cond": [{"$lt": ["$wellnessProfile.score", 50]}, 1, 0]}},
+            "positiveUsers": {"$sum": {"$cond": [{"$gte": ["$wellnessProfile.score", 75]}, 1, 0]}}
+        }}
+    ]
+    result = list(users_collection.aggregate(pipeline))
+    counters = result[0] if result else {}
+    stats = {
+        "totalUsers": users_collection.count_documents({}),
+        "scoredUsers": counters.get("scoredUsers", 0),
+        "scoreSum": counters.get("scoreSum", 0),
+        "highRisk": counters.get("highRisk", 0),
+        "positiveUsers": counters.get("positiveUsers", 0),
+        "reconciledAt": datetime.datetime.now(timezone.utc)
+    }
+    if stats_collection is not None:
+        stats_collection.update_one({"_id": STATS_DOC_ID}, {"$set": stats}, upsert=True)
+    return stats
+
+def load_stats():
+    stats = stats_collection.find_one({"_id": STATS_DOC_ID}) if stats_collection is not None else None
+    if not stats or "reconciledAt" not in stats:
+        stats = reconcile_stats()
+    return stats
+
+def run_stats_reconciler():
+    while True:
+        try:
+            if claim_job("stats_reconciler", 2 * STATS_RECONCILE_SECONDS): reconcile_stats()
+        except Exception as e:
+            print("Stats reconcile error:", e)
+        time.sleep(STATS_RECONCILE_SECONDS)
+
+# --------------------------------------------------
+#           WELLNESS TIME SERIES
+# --------------------------------------------------
+WELLNESS_BUCKET_SIZE = 200 # Samples per bucket document
+WELLNESS_MAX_DAYS = 365
+DROP_WINDOW_DAYS = 7
+DROP_ALERT_POINTS = float(os.getenv("WELLNESS_DROP_ALERT_POINTS", "20")) # Latest score this far below the window average
+HIGH_RISK_SCORE = 50
+
+def iso_utc(value):
+    if value.tzinfo is None: value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat()
+
+def parse_days(value, default):
+    try:
+        return max(1, min(int(value), WELLNESS_MAX_DAYS))
+    except (TypeError, ValueError):
+        return default
+
+def record_wellness_sample(user_id, score, timestamp):
+    """Append one check-in to the user's open bucket; a full bucket no longer matches, so the upsert opens a new one."""
+    if wellness_series_collection is None or not isinstance(score, (int, float)): return
+    wellness_series_collection.update_one(
+        {"user_id": user_id, "count": {"$lt": WELLNESS_BUCKET_SIZE}},
+        {
+            "$push": {"samples": {"t": timestamp, "s": score}},
+            "$inc": {"count": 1, "sum": score},
+            "$min": {"start": timestamp},
+            "$max": {"end": timestamp}
+        },
+        upsert=True
+    )
+
+def wellness_samples_pipeline(match, since):
+    # Buckets whose last sample is in range, flattened to one row per sample
+    return [
+        {"$match": dict(match, end={"$gte": since})},
+        {"$unwind": "$samples"},
+        {"$match": {"samples.t": {"$gte": since}}},
+        {"$sort": {"samples.t": 1}}
+    ]
+
+def wellness_history(user_id, since, limit):
+    pipeline = wellness_samples_pipeline({"user_id": user_id}, since) + [
+        {"$sort": {"samples.t": -1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "t": "$samples.t", "s": "$samples.s"}}
+    ]
+    rows = list(wellness_series_collection.aggregate(pipeline))
+    return [{"timestamp": iso_utc(row["t"]), "score": row["s"]} for row in reversed(rows)]
+
+def wellness_daily(user_id, since):
+    pipeline = wellness_samples_pipeline({"user_id": user_id}, since) + [
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$samples.t"}},
+            "avg": {"$avg": "$samples.s"},
+            "min": {"$min": "$samples.s"},
+            "max": {"$max": "$samples.s"},
+            "checkins": {"$sum": 1}
+        }},
+        {"$sort": {"_id": 1}}
+    ]
+    return list(wellness_series_collection.aggregate(pipeline))
+
+def wellness_trend(days, window):
+    """Rolling average over the last `window` check-in days and a least-squares slope in points per day."""
+    if not days: return {"days": [], "slope": None}
+    first = datetime.date.fromisoformat(days[0]["_id"])
+    xs = [(datetime.date.fromisoformat(day["_id"]) - first).days for day in days]
+    ys = [day["avg"] for day in days]
+
+    rows = []
+    running = 0
+    for i, day in enumerate(days):
+        running += ys[i]
+        if i >= window: running -= ys[i - window]
+        rows.append({
+            "date": day["_id"], "avg": round(ys[i], 1), "min": day["min"], "max": day["max"],
+            "checkins": day["checkins"], "rollingAvg": round(running / min(i + 1, window), 1)
+        })
+
+    slope = None
+    if len(days) > 1:
+        mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+        spread = sum((x - mean_x) ** 2 for x in xs)
+        slope = round(sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread, 2) if spread else 0
+    return {"days": rows, "slope": slope}
+
+def cohort_scores(since, match=None):
+    # Per-user average over the window, grouped in Mongo and returned as one sorted array
+    pipeline = wellness_samples_pipeline(match or {}, since)[:-1] + [
+        {"$group": {"_id": "$user_id", "avg": {"$avg": "$samples.s"}}},
+        {"$sort": {"avg": 1}},
+        {"$group": {"_id": None, "scores": {"$push": "$avg"}}}
+    ]
+    result = list(wellness_series_collection.aggregate(pipeline))
+    return result[0]["scores"] if result else []
+
+def percentile(sorted_values, pct):
+    # Linear interpolation between closest ranks
+    if not sorted_values: return None
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = math.floor(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+def window_average(user_id, since):
+    # (average, check-ins) of one user's samples since `since`
+    pipeline = wellness_samples_pipeline({"user_id": user_id}, since)[:-1] + [
+        {"$group": {"_id": None, "avg": {"$avg": "$samples.s"}, "checkins": {"$sum": 1}}}
+    ]
+    result = list(wellness_series_collection.aggregate(pipeline))
+    return (result[0]["avg"], result[0]["checkins"]) if result else (None, 0)
+
+def backfill_wellness_series():
+    # Seed each user's series with their current snapshot so trends have a starting point
+    try:
+        seeded = set(wellness_series_collection.distinct("user_id"))
+        for user in users_collection.find({"wellnessProfile.score": {"$type": "number"}}, {"user_id": 1, "wellnessProfile": 1}):
+            if user["user_id"] in seeded: continue
+            profile = user["wellnessProfile"]
+            timestamp = parse_cursor_time(profile.get("lastUpdate"), True) or datetime.datetime.now(timezone.utc)
+            try:
+                # One fixed bucket id per user, so overlapping runs cannot seed the snapshot twice
+                wellness_series_collection.insert_one({
+                    "_id": f"seed:{user['user_id']}", "user_id": user["user_id"],
+                    "samples": [{"t": timestamp, "s": profile["score"]}], "count": 1, "sum": profile["score"],
+                    "start": timestamp, "end": timestamp
+                })
+            except DuplicateKeyError:
+                pass
+    except Exception as e:
+        print("Wellness series backfill error:", e)
+
+# --------------------------------------------------
+#           USER PROFILE HYDRATION
+# --------------------------------------------------
+PROFILE_FIELDS = {"_id": 0, "user_id": 1, "firstName": 1, "lastName": 1, "email": 1, "aiResponseCache": 1}
+profile_cache = TTLCache(maxsize=int(os.getenv("PROFILE_CACHE_SIZE", "5000")), ttl=300)
+
+def hydrate_users(user_ids):
+    # Resolve many user_ids to public profiles: cache first, then one $in query for the rest
+    profiles = {}
+    missing = []
+    for user_id in set(user_ids):
+        profile = profile_cache.get(user_id)
+        if profile is None: missing.append(user_id)
+        else: profiles[user_id] = profile
+    if missing and users_collection is not None:
+        for user in users_collection.find({"user_id": {"$in": missing}}, PROFILE_FIELDS):
+            profile_cache.set(user["user_id"], user)
+            profiles[user["user_id"]] = user
+    return profiles
+
+# --------------------------------------------------
+#            AI RESPONSE CACHE (OPT-IN)
+# --------------------------------------------------
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE") == "1"
+RESPONSE_CACHE_MAX_HISTORY = int(os.getenv("RESPONSE_CACHE_MAX_HISTORY", "0"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0")) # 0 disables the fuzzy tier
+RESPONSE_CACHE_BUCKET_SIZE = 500
+
+def normalize_prompt(text):
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+def embed_prompt(normalized):
+    # Hashed character-trigram vector, unit length; a cheap local stand-in for a sentence embedding
+    padded = f"  {normalized} "
+    counts = {}
+    for i in range(len(padded) - 2):
+        bucket = hash(padded[i:i + 3]) % 4096
+        counts[bucket] = counts.get(bucket, 0) + 1
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {k: v / norm for k, v in counts.items()}
+
+def cosine(a, b):
+    if len(a) > len(b): a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+class ResponseCache:
+    """Exact-match reply cache keyed on (persona hash, normalized prompt) with an optional similarity tier."""
+
+    def __init__(self, maxsize, ttl, similarity=0):
+        self.similarity = similarity
+        self._exact = TTLCache(maxsize, ttl)
+        self._vectors = {} # persona hash -> OrderedDict(normalized prompt -> vector)
+        self._lock = threading.Lock()
+        self.counters = {"exactHits": 0, "similarHits": 0, "misses": 0, "stores": 0}
+
+    def _count(self, name):
+        with self._lock: self.counters[name] += 1
+
+    def get(self, persona_hash, prompt):
+        normalized = normalize_prompt(prompt)
+        reply = self._exact.get((persona_hash, normalized))
+        if reply is not None:
+            self._count("exactHits")
+            return reply
+        if self.similarity:
+            vector = embed_prompt(normalized)
+            with self._lock:
+                candidates = list(self._vectors.get(persona_hash, {}).items())
+            best, best_score = None, self.similarity
+            for candidate, candidate_vector in candidates:
+                score = cosine(vector, candidate_vector)
+                if score >= best_score: best, best_score = candidate, score
+            if best is not None:
+                reply = self._exact.get((persona_hash, best))
+                if reply is not None:
+                    self._count("similarHits")
+                    return reply
+        self._count("misses")
+        return None
+
+    def set(self, persona_hash, prompt, reply):
+        normalized = normalize_prompt(prompt)
+        self._exact.set((persona_hash, normalized), reply)
+        if self.similarity:
+            with self._lock:
+                bucket = self._vectors.setdefault(persona_hash, OrderedDict())
+                bucket[normalized] = embed_prompt(normalized)
+                bucket.move_to_end(normalized)
+                while len(bucket) > RESPONSE_CACHE_BUCKET_SIZE: bucket.popitem(last=False)
+        self._count("stores")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        lookups = stats["exactHits"] + stats["similarHits"] + stats["misses"]
+        stats["hitRate"] = round((stats["exactHits"] + stats["similarHits"]) / lookups, 3) if lookups else 0
+        stats["enabled"] = RESPONSE_CACHE_ENABLED
+        stats["size"] = self._exact.stats()["size"]
+        return stats
+
+response_cache = ResponseCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "2000")),
+    ttl=int(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+    similarity=RESPONSE_CACHE_SIMILARITY
+)
+
+def response_cacheable(turn, data):
+    if not RESPONSE_CACHE_ENABLED or data.get("private"): return False
+    if len(turn["history"]) > RESPONSE_CACHE_MAX_HISTORY or "[SYSTEM:" in turn["message"]: return False
+    profile = hydrate_users([turn["user_id"]]).get(turn["user_id"], {})
+    return profile.get("aiResponseCache", True) is not False
+
+# --------------------------------------------------
+#               USER SEARCH INDEX
+# --------------------------------------------------
+SEARCH_RESULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 50
+
+def search_keys_for(user):
+    # Lowercased names/email plus their word pieces, matched with anchored (index-friendly) prefixes
+    keys = set()
+    for field in ("firstName", "lastName", "email"):
+        value = (user.get(field) or "").strip().lower()
+        if not value: continue
+        keys.add(value)
+        keys.update(piece for piece in re.split(r"[\W_]+", value) if piece)
+    return sorted(keys)
+
+def search_keys_clauses(query):
+    # Every word must prefix-match some key
+    return [{"searchKeys": re.compile("^" + re.escape(w))} for w in query.lower().split()]
+
+def backfill_search_keys():
+    try:
+        fields = {"firstName": 1, "lastName": 1, "email": 1}
+        for user in users_collection.find({"searchKeys": {"$exists": False}}, fields):
+            users_collection.update_one({"_id": user["_id"]}, {"$set": {"searchKeys": search_keys_for(user)}})
+    except Exception as e:
+        print("Search index backfill error:", e)
+
+# --------------------------------------------------
+#           REALTIME DELIVERY (SSE)
+# --------------------------------------------------
+SSE_HEARTBEAT_SECONDS = 15
+SSE_QUEUE_SIZE = 100
+# Every open stream pins one server thread (sync/gthread workers). Keep SSE_MAX_STREAMS well below
+# the worker's thread count minus the LLM budget; beyond it streams get a 503 and pages poll instead.
+# With gevent/eventlet workers (`gunicorn -k gevent --worker-connections 1000`) streams are cheap
+# greenlets and the cap can be raised to a few hundred.
+SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", "32"))
+sse_streams = {"open": 0, "rejected": 0}
+sse_streams_lock = threading.Lock()
+
+class LocalBroker:
+    """In-process fan-out registry: channel -> subscriber queues."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, channel):
+        q = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(q)
+        return q
+
+    def unsubscribe(self, channel, q):
+        with self._lock:
+            subs = self._subscribers.get(channel)
+            if subs is None: return
+            subs.discard(q)
+            if not subs: del self._subscribers[channel]
+
+    def publish(self, channel, payload):
+        self.dispatch(channel, payload)
+
+    def dispatch(self, channel, payload):
+        with self._lock:
+            subs = list(self._subscribers.get(channel, ()))
+        for q in subs:
+            try:
+                q.put_nowait(payload)
+            except queue.Full:
+                pass # Slow client; it resyncs with a full fetch on reconnect
+
+    def adopt(self, previous):
+        """Take over the subscribers of the broker this one replaces."""
+        with previous._lock:
+            inherited = {channel: set(subs) for channel, subs in previous._subscribers.items()}
+        with self._lock:
+            for channel, subs in inherited.items():
+                self._subscribers.setdefault(channel, set()).update(subs)
+
+class MongoBroker(LocalBroker):
+    """Shares events between workers through a capped collection; each worker tails it and fans out locally."""
+
+    def __init__(self, database, name="realtime_events", size_bytes=16 * 1024 * 1024):
+        super().__init__()
+        if name not in database.list_collection_names():
+            try:
+                database.create_collection(name, capped=True, size=size_bytes)
+            except CollectionInvalid:
+                pass # Another worker booting alongside created it first
+            except OperationFailure as e:
+                if e.code != 48: raise # 48: NamespaceExists
+        self._events = database[name]
+        self._tail_thread = None
+
+    def subscribe(self, channel):
+        self._ensure_tailing()
+        return super().subscribe(channel)
+
+    def publish(self, channel, payload):
+        self._events.insert_one({"channel": channel, "payload": payload})
+
+    def adopt(self, previous):
+        super().adopt(previous)
+        if self._subscribers: self._ensure_tailing()
+
+    def _ensure_tailing(self):
+        if self._tail_thread is not None and self._tail_thread.is_alive(): return
+        self._tail_thread = threading.Thread(target=self._tail, daemon=True)
+        self._tail_thread.start()
+
+    def _tail(self):
+        last = self._events.find_one(sort=[("$natural", -1)])
+        last_id = last["_id"] if last else None
+        while True:
+            query = {"_id": {"$gt": last_id}} if last_id else {}
+            try:
+                cursor = self._events.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    for event in cursor:
+                        last_id = event["_id"]
+                        self.dispatch(event["channel"], event["payload"])
+            except Exception as e:
+                print("Realtime broker error:", e)
+            time.sleep(1)
+
+def create_broker():
+    if os.getenv("REALTIME_BROKER") == "mongo" and db is not None:
+        return MongoBroker(db)
+    return LocalBroker()
+
+broker = LocalBroker() # Swapped for the configured broker by init_shared_stores()
+
+def valid_ids(*ids):
+    # Channel names and conversation members are built from these; None or non-strings break both
+    return all(isinstance(i, str) and i for i in ids)
+
+def p2p_channel(user_a, user_b):
+    return "p2p:" + ":".join(sorted([user_a, user_b]))
+
+def group_channel(group_id):
+    return f"group:{group_id}"
+
+def sse_event(payload, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload, default=str)}\n\n"
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def sse_response(channel):
+    with sse_streams_lock:
+        if sse_streams["open"] >= SSE_MAX_STREAMS:
+            sse_streams["rejected"] += 1
+            full = True
+        else:
+            sse_streams["open"] += 1
+            full = False
+    if full: # EventSource gives up on a non-200 answer; the pages then fall back to polling
+        return jsonify({"error": "Too many live connections, polling instead"}), 503, {"Retry-After": "30"}
+    q = broker.subscribe(channel)
+    closed = []
+
+    def close():
+        # call_on_close also runs when the client leaves before the generator ever started
+        if closed: return
+        closed.append(True)
+        broker.unsubscribe(channel, q)
+        with sse_streams_lock: sse_streams["open"] -= 1
+
+    def generate():
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                payload = q.get(timeout=SSE_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            yield sse_event(payload)
+
+    response = Response(generate(), mimetype="text/event-stream", headers=SSE_HEADERS)
+    response.call_on_close(close)
+    return response
+
+# --------------------------------------------------
+#           CONVERSATION INBOX
+# --------------------------------------------------
+# One document per p2p pair or group, keyed by its realtime channel name:
+#   {_id: "p2p:<a>:<b>" | "group:<id>", type, members, last_message, timestamp, message_count, unread: {user_id: n}}
+INBOX_PREVIEW_CHARS = 120
+group_members_cache = TTLCache(maxsize=5000, ttl=300)
+
+def group_members(group_id):
+    members = group_members_cache.get(group_id)
+    if members is None:
+        group = groups_collection.find_one({"group_id": group_id}, {"_id": 0, "members": 1})
+        members = group.get("members", []) if group else []
+        group_members_cache.set(group_id, members)
+    return members
+
+def message_preview(msg):
+    return {
+        "message_id": msg["message_id"], "sender_id": msg["sender_id"], "sender_name": msg.get("sender_name"),
+        "text": (msg.get("text") or "")[:INBOX_PREVIEW_CHARS]
+    }
+
+def touch_conversation(conversation_id, kind, members, msg):
+    # Single atomic upsert per send: new preview, +1 unread for everyone but the sender
+    if conversations_collection is None: return
+    inc = {f"unread.{member}": 1 for member in members if member != msg["sender_id"]}
+    inc["message_count"] = 1
+    conversations_collection.update_one(
+        {"_id": conversation_id},
+        {
+            "$set": {"last_message": message_preview(msg), "timestamp": msg["timestamp"], "members": members},
+            "$inc": inc,
+            "$setOnInsert": {"type": kind}
+        },
+        upsert=True
+    )
+
+def inbox_entry(base, conversation, user_id):
+    conversation = conversation or {}
+    return dict(
+        base,
+        last_message=conversation.get("last_message"),
+        timestamp=conversation.get("timestamp"),
+        unread=conversation.get("unread", {}).get(user_id, 0)
+    )
+
+def by_recent_activity(entries):
+    # Active conversations newest first, then the ones without messages by name
+    active = sorted((e for e in entries if e["timestamp"]), key=lambda e: e["timestamp"], reverse=True)
+    return active + sorted((e for e in entries if not e["timestamp"]), key=lambda e: e["name"].lower())
+
+def backfill_conversations():
+    # First run: build summaries from existing history (p2p unread from the stored read flags)
+    try:
+        if backfill_completed("backfill_conversations"): return
+        pairs = {}
+        pipeline = [
+            {"$sort": {"timestamp": 1}},
+            {"$group": {
+                "_id": {"sender_id": "$sender_id", "receiver_id": "$receiver_id"},
+                "last": {"$last": "$$ROOT"}, "count": {"$sum": 1},
+                "unread": {"$sum": {"$cond": [{"$eq": ["$read", False]}, 1, 0]}}
+            }}
+        ]
+        for row in p2p_messages_collection.aggregate(pipeline, allowDiskUse=True):
+            sender, receiver = row["_id"].get("sender_id"), row["_id"].get("receiver_id")
+            if not valid_ids(sender, receiver): continue # Malformed legacy rows have no conversation
+            summary = pairs.setdefault(p2p_channel(sender, receiver), {"members": sorted([sender, receiver]), "count": 0, "unread": {}, "last": None})
+            summary["count"] += row["count"]
+            summary["unread"][receiver] = row["unread"]
+            if summary["last"] is None or row["last"]["timestamp"] > summary["last"]["timestamp"]: summary["last"] = row["last"]
+        for conversation_id, summary in pairs.items():
+            conversations_collection.update_one({"_id": conversation_id}, {"$setOnInsert": {
+                "type": "p2p", "members": summary["members"], "last_message": message_preview(summary["last"]),
+                "timestamp": summary["last"]["timestamp"], "message_count": summary["count"], "unread": summary["unread"]
+            }}, upsert=True)
+
+        pipeline = [{"$sort": {"timestamp": 1}}, {"$group": {"_id": "$group_id", "last": {"$last": "$$ROOT"}, "count": {"$sum": 1}}}]
+        for row in group_messages_collection.aggregate(pipeline, allowDiskUse=True):
+            conversations_collection.update_one({"_id": group_channel(row["_id"])}, {"$setOnInsert": {
+                "type": "group", "members": group_members(row["_id"]), "last_message": message_preview(row["last"]),
+                "timestamp": row["last"]["timestamp"], "message_count": row["count"], "unread": {}
+            }}, upsert=True)
+        mark_backfill_completed("backfill_conversations")
+    except Exception as e:
+        print("Conversation backfill error:", e)
+
+# --------------------------------------------------
+#               FRIEND GRAPH
+# --------------------------------------------------
+# One document per direction, so "friends of X" and the friend-of-friend fan-out are
+# both covered scans of the (user_id, friend_id) index:
+#   {_id: "<user_id>:<friend_id>", user_id, friend_id, since}
+SUGGESTION_LIMIT = 10
+SUGGESTION_MAX_LIMIT = 50
+suggestion_cache = TTLCache(maxsize=int(os.getenv("SUGGESTION_CACHE_SIZE", "5000")), ttl=600)
+
+def edge_id(user_id, friend_id):
+    return f"{user_id}:{friend_id}"
+
+def friends_of(user_id):
+    if friendships_collection is None: return []
+    return [e["friend_id"] for e in friendships_collection.find({"user_id": user_id}, {"_id": 0, "friend_id": 1})]
+
+def are_friends(user_id, friend_id):
+    return friendships_collection.find_one({"_id": edge_id(user_id, friend_id)}, {"_id": 1}) is not None
+
+def add_friendships(pairs, since):
+    """Write both edges for each (a, b) pair. Idempotent: edges already present are skipped."""
+    docs = {}
+    for a, b in pairs:
+        if a == b: continue
+        for user_id, friend_id in ((a, b), (b, a)):
+            docs[edge_id(user_id, friend_id)] = {"_id": edge_id(user_id, friend_id), "user_id": user_id, "friend_id": friend_id, "since": since}
+    if not docs: return
+    try:
+        friendships_collection.insert_many(list(docs.values()), ordered=False)
+    except BulkWriteError as e:
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])): raise
+
+def invalidate_suggestions(*user_ids):
+    # A new edge changes mutual counts for both people and for everyone already friends with either
+    affected = set(user_ids)
+    for user_id in user_ids: affected.update(friends_of(user_id))
+    for user_id in affected: suggestion_cache.pop(user_id)
+
+def compute_suggestions(user_id):
+    # One aggregation over all friends' edges: count how many of my friends each candidate shares
+    friends = friends_of(user_id)
+    if not friends: return []
+    exclude = set(friends) | {user_id}
+    for req in friend_requests_collection.find({"status": "pending", "$or": [{"sender_id": user_id}, {"receiver_id": user_id}]},
+                                               {"_id": 0, "sender_id": 1, "receiver_id": 1}):
+        exclude.add(req["receiver_id"] if req["sender_id"] == user_id else req["sender_id"])
+    pipeline = [
+        {"$match": {"user_id": {"$in": friends}, "friend_id": {"$nin": list(exclude)}}},
+        {"$group": {"_id": "$friend_id", "mutual": {"$sum": 1}}},
+        {"$sort": {"mutual": -1, "_id": 1}},
+        {"$limit": SUGGESTION_MAX_LIMIT}
+    ]
+    return [(row["_id"], row["mutual"]) for row in friendships_collection.aggregate(pipeline)]
+
+def friend_suggestions(user_id):
+    cached = suggestion_cache.get(user_id)
+    if cached is None:
+        cached = compute_suggestions(user_id)
+        suggestion_cache.set(user_id, cached)
+    return cached
+
+def migrate_friend_arrays():
+    # Move legacy users.friends arrays into edges; each user is unset only after its edges exist,
+    # so an interrupted run simply resumes (and duplicated array entries collapse into one edge)
+    try:
+        now = datetime.datetime.now(timezone.utc)
+        for user in users_collection.find({"friends": {"$exists": True}}, {"user_id": 1, "friends": 1}):
+            add_friendships([(user["user_id"], f) for f in set(user.get("friends") or []) if f], now)
+            users_collection.update_one({"_id": user["_id"]}, {"$unset": {"friends": ""}})
+    except Exception as e:
+        print("Friend graph migration error:", e)
+
+# --------------------------------------------------
+#           RETENTION & ARCHIVAL
+# --------------------------------------------------
+# Conversations idle for longer than their policy are moved out of the hot collections into one
+# compressed JSON-lines bundle each, and moved back the first time someone opens their history.
+# The summary document (chat_sessions / conversations) records where the bundle is:
+#   archived: {key, codec, count, through, at}
+RETENTION_POLICIES = {
+    "ai_chat": {"archiveAfterDays": int(os.getenv("RETENTION_AI_CHAT_DAYS", "90"))},
+    "p2p": {"archiveAfterDays": int(os.getenv("RETENTION_P2P_DAYS", "180"))},
+    "group": {"archiveAfterDays": int(os.getenv("RETENTION_GROUP_DAYS", "180"))},
+    "temp_chat": {"expireAfterHours": int(os.getenv("TEMP_CHAT_TTL_HOURS", "24"))}
+}
+TEMP_CHAT_TTL = datetime.timedelta(hours=RETENTION_POLICIES["temp_chat"]["expireAfterHours"])
+RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "21600"))
+RETENTION_LEASE = datetime.timedelta(minutes=5)
+ARCHIVE_CODEC = os.getenv("ARCHIVE_CODEC", "zstd" if zstandard else "gzip")
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+retention_stats = {"archived": 0, "archivedMessages": 0, "rehydrated": 0, "errors": 0, "lastRun": None}
+
+def compress_bundle(data, codec):
+    if codec == "zstd": return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=9)
+
+def decompress_bundle(data, codec):
+    if codec == "zstd": return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+class DiskArchiveStore:
+    """Bundles as files under ARCHIVE_DIR; only suitable where that disk outlives the worker."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        # Keys come back from stored markers; never follow one outside the archive root
+        root = os.path.realpath(self.root)
+        path = os.path.realpath(os.path.join(root, *key.split("/")))
+        if os.path.commonpath([root, path]) != root or path == root:
+            raise ValueError(f"archive key escapes the archive root: {key!r}")
+        return path
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path) # Readers never see a half-written bundle
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+class GridFSArchiveStore:
+    """Bundles in the same database (fs bucket "archive"): durable on hosts with ephemeral disks."""
+
+    def __init__(self, database):
+        import gridfs
+        self.fs = gridfs.GridFS(database, collection="archive")
+
+    def put(self, key, data):
+        old = [f._id for f in self.fs.find({"filename": key})]
+        self.fs.put(data, filename=key)
+        for file_id in old: self.fs.delete(file_id)
+
+    def get(self, key):
+        f = self.fs.find_one({"filename": key}, sort=[("uploadDate", -1)])
+        return f.read() if f is not None else None
+
+    def delete(self, key):
+        for f in self.fs.find({"filename": key}): self.fs.delete(f._id)
+
+def create_archive_store():
+    if os.getenv("ARCHIVE_STORE") == "gridfs" and db is not None:
+        return GridFSArchiveStore(db)
+    return DiskArchiveStore(ARCHIVE_DIR)
+
+archive_store = None # Created per worker by init_worker()
+
+def archive_key(kind, *ids):
+    # Ids are client-chosen strings; hashing them keeps separators and ".." out of the key
+    digest = hashlib.sha256("\0".join(ids).encode("utf-8")).hexdigest()
+    return f"{kind}/{digest}"
+
+def archive_target(kind, summary):
+    # (bundle key, message collection, query for the conversation's hot messages)
+    if kind == "ai_chat":
+        key = archive_key(kind, summary["user_id"], summary["session_id"])
+        return key, messages_collection, {"session_id": summary["session_id"], "user_id": summary["user_id"]}
+    key = archive_key(kind, summary["_id"])
+    if kind == "group":
+        return key, group_messages_collection, {"group_id": summary["_id"].split(":", 1)[1]}
+    a, b = summary["members"]
+    return key, p2p_messages_collection, {"$or": [{"sender_id": a, "receiver_id": b}, {"sender_id": b, "receiver_id": a}]}
+
+def summary_collection(kind):
+    return chat_sessions_collection if kind == "ai_chat" else conversations_collection
+
+@contextmanager
+def retention_lease(summaries, summary_id, wait=0):
+    # Archiving and rehydrating the same conversation must not interleave (across workers too)
+    deadline = time.monotonic() + wait
+    while True:
+        now = datetime.datetime.now(timezone.utc)
+        acquired = summaries.update_one(
+            {"_id": summary_id, "$or": [{"retentionLease": {"$exists": False}}, {"retentionLease": {"$lt": now}}]},
+            {"$set": {"retentionLease": now + RETENTION_LEASE}}
+        ).modified_count == 1
+        if acquired or time.monotonic() >= deadline: break
+        time.sleep(0.05)
+    try:
+        yield acquired
+    finally:
+        if acquired: summaries.update_one({"_id": summary_id}, {"$unset": {"retentionLease": ""}})
+
+def read_bundle(marker):
+    data = archive_store.get(marker["key"])
+    if data is None: return []
+    lines = decompress_bundle(data, marker.get("codec", "gzip")).decode("utf-8").splitlines()
+    return [json_util.loads(line) for line in lines if line]
+
+def restore_messages(collection, docs):
+    # Bundles keep each document's _id, so a repeated restore cannot duplicate messages
+    for i in range(0, len(docs), 1000):
+        try:
+            collection.insert_many(docs[i:i + 1000], ordered=False)
+        except BulkWriteError as e:
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])): raise
+
+def archive_conversation(kind, summary):
+    summaries = summary_collection(kind)
+    key, collection, query = archive_target(kind, summary)
+    with retention_lease(summaries, summary["_id"]) as acquired:
+        if not acquired: return 0
+        marker = summary.get("archived")
+        hot = list(collection.find(query).sort([("timestamp", 1), ("message_id", 1)]))
+        if not hot and marker: # Nothing new since the last run; just record that
+            summaries.update_one({"_id": summary["_id"]}, {"$set": {"archived.through": summary["timestamp"]}})
+            return 0
+        docs = (read_bundle(marker) if marker else []) + hot
+        if not docs: return 0
+        payload = "\n".join(json_util.dumps(doc) for doc in docs).encode("utf-8")
+        archive_store.put(key, compress_bundle(payload, ARCHIVE_CODEC))
+        summaries.update_one({"_id": summary["_id"]}, {"$set": {"archived": {
+            "key": key, "codec": ARCHIVE_CODEC, "count": len(docs), "through": summary["timestamp"],
+            "at": datetime.datetime.now(timezone.utc)
+        }}})
+        if marker and marker["key"] != key: archive_store.delete(marker["key"]) # Bundle written under an older key scheme
+        ids = [doc["_id"] for doc in hot]
+        for i in range(0, len(ids), 1000):
+            collection.delete_many({"_id": {"$in": ids[i:i + 1000]}})
+    retention_stats["archived"] += 1
+    retention_stats["archivedMessages"] += len(hot)
+    return len(hot)
+
+def archive_cold_conversations(now=None):
+    """One pass over every policy; returns messages moved out of the hot collections per kind."""
+    now = now or datetime.datetime.now(timezone.utc)
+    moved = {}
+    for kind in ("ai_chat", "p2p", "group"):
+        days = RETENTION_POLICIES[kind]["archiveAfterDays"]
+        summaries = summary_collection(kind)
+        if not days or summaries is None: continue
+        cutoff = now - datetime.timedelta(days=days)
+        if kind == "ai_chat": query = {"timestamp": {"$lt": cutoff}, "expiresAt": {"$exists": False}}
+        else: query = {"type": kind, "timestamp": {"$lt": cutoff.isoformat()}}
+        moved[kind] = 0
+        fields = {"user_id": 1, "session_id": 1, "members": 1, "timestamp": 1, "archived": 1}
+        for summary in summaries.find(query, fields):
+            if summary.get("archived", {}).get("through") == summary["timestamp"]: continue
+            try:
+                moved[kind] += archive_conversation(kind, summary)
+            except Exception as e:
+                retention_stats["errors"] += 1
+                print(f"❌ Archiving {kind} {summary['_id']} failed:", e)
+    retention_stats["lastRun"] = now
+    return moved
+
+def rehydrate(kind, summary_query):
+    """Move an archived conversation back into its hot collection before its history is read."""
+    summaries = summary_collection(kind)
+    if summaries is None or archive_store is None: return 0
+    summary = summaries.find_one(dict(summary_query, archived={"$exists": True}))
+    if summary is None: return 0
+    _, collection, _ = archive_target(kind, summary)
+    with retention_lease(summaries, summary["_id"], wait=5) as acquired:
+        if not acquired: return 0 # Still being archived elsewhere; serve what is hot
+        summary = summaries.find_one({"_id": summary["_id"]}, {"archived": 1})
+        marker = summary.get("archived") if summary else None
+        if not marker: return 0
+        docs = read_bundle(marker)
+        restore_messages(collection, docs)
+        summaries.update_one({"_id": summary["_id"]}, {"$unset": {"archived": ""}})
+        archive_store.delete(marker["key"])
+    retention_stats["rehydrated"] += 1
+    return len(docs)
+
+def delete_archived(kind, summary_query):
+    summaries = summary_collection(kind)
+    if summaries is None or archive_store is None: return
+    for summary in summaries.find(dict(summary_query, archived={"$exists": True}), {"archived": 1}):
+        archive_store.delete(summary["archived"]["key"])
+
+def run_retention():
+    while True:
+        try:
+            if claim_job("retention", 2 * RETENTION_INTERVAL_SECONDS): archive_cold_conversations()
+        except Exception as e:
+            print("Retention error:", e)
+        time.sleep(RETENTION_INTERVAL_SECONDS)
+
+# --------------------------------------------------
+#               ALERT ENGINE
+# --------------------------------------------------
+ALERTS_CHANNEL = "admin:alerts"
+ALERT_COOLDOWN = datetime.timedelta(hours=int(os.getenv("ALERT_COOLDOWN_HOURS", "6")))
+
+def format_alert(alert):
+    return {
+        "id": alert["alert_id"],
+        "user_id": alert["user_id"],
+        "user": alert.get("user", ""),
+        "type": alert["type"],
+        "rule": alert["rule"],
+        "severity": alert["severity"],
+        "time": iso_utc(alert["createdAt"])
+    }
+
+def recently_alerted(user_id, rule, now):
+    return alerts_collection.find_one(
+        {"user_id": user_id, "rule": rule, "createdAt": {"$gte": now - ALERT_COOLDOWN}}, {"_id": 1}
+    ) is not None
+
+def raise_alert(user, rule, severity, message, now, details=None, alert_id=None):
+    """Store an alert and push it to subscribed admin pages. Entry point for every detection rule.
+
+    A fixed alert_id makes the call idempotent: a repeat returns None and publishes nothing.
+    """
+    alert = {
+        "alert_id": alert_id or str(uuid.uuid4()),
+        "user_id": user["user_id"],
+        "user": f"{user.get('firstName', '')} {user.get('lastName', '')}",
+        "rule": rule, "type": message, "severity": severity,
+        "details": details or {}, "createdAt": now
+    }
+    try:
+        alerts_collection.insert_one(dict(alert))
+    except DuplicateKeyError:
+        return None
+    broker.publish(ALERTS_CHANNEL, format_alert(alert))
+    return alert
+
+def evaluate_wellness_rules(user, old_score, score, now):
+    # Runs once per check-in, so detection cost follows writes rather than dashboard loads
+    if alerts_collection is None or not isinstance(score, (int, float)): return []
+    raised = []
+    user_id = user["user_id"]
+
+    crossed = not isinstance(old_score, (int, float)) or old_score >= HIGH_RISK_SCORE
+    if score < HIGH_RISK_SCORE and (crossed or not recently_alerted(user_id, "low_score", now)):
+        raised.append(raise_alert(user, "low_score", "high", "Low wellness score detected", now, {"score": score}))
+
+    if wellness_series_collection is not None:
+        avg, checkins = window_average(user_id, now - datetime.timedelta(days=DROP_WINDOW_DAYS))
+        if checkins and avg - score >= DROP_ALERT_POINTS and not recently_alerted(user_id, "sharp_drop", now):
+            raised.append(raise_alert(
+                user, "sharp_drop", "high" if score < HIGH_RISK_SCORE else "medium",
+                f"Wellness score dropped {round(avg - score)} points below {DROP_WINDOW_DAYS}-day average",
+                now, {"score": score, "average": round(avg, 1)}
+            ))
+    return raised
+
+def backfill_alerts():
+    # First run: seed open low-score alerts so the dashboard is not empty until the next check-in
+    try:
+        if alerts_collection.find_one({}, {"_id": 1}) is not None: return
+        fields = {"user_id": 1, "firstName": 1, "lastName": 1, "wellnessProfile": 1}
+        for user in users_collection.find({"wellnessProfile.score": {"$lt": HIGH_RISK_SCORE}}, fields):
+            profile = user["wellnessProfile"]
+            created = parse_cursor_time(profile.get("lastUpdate"), True) or datetime.datetime.now(timezone.utc)
+            raise_alert(user, "low_score", "high", "Low wellness score detected", created, {"score": profile["score"]},
+                        alert_id=f"backfill:low_score:{user['user_id']}")
+    except Exception as e:
+        print("Alert backfill error:", e)
+
 # --------------------------------------------------
 #               AUTH ROUTES
 # --------------------------------------------------
@@ -155,10 +2385,11 @@ def signup():
         "emergencyContact": data.get("emergencyContact"),
         "role": data.get("role", "user"),
         "password": generate_password_hash(data.get("password")),
-        "created_at": datetime.datetime.now(timezone.utc),
-        "friends": [] 
+        "created_at": datetime.datetime.now(timezone.utc)
     }
+    user_data["searchKeys"] = search_keys_for(user_data)
     users_collection.insert_one(user_data)
+    bump_stats({"totalUsers": 1, "usersVersion": 1})
     return jsonify({"message": "User created", "success": True}), 201
 
 @app.route("/login", methods=["POST"])
@@ -185,7 +2416,7 @@ def login():
 @app.route("/users/<user_id>", methods=["GET"])
 def get_user_profile(user_id):
     if users_collection is None: return jsonify({"error": "DB error"}), 500
-    user = users_collection.find_one({"user_id": user_id}, {"_id": 0, "password": 0})
+    user = users_collection.find_one({"user_id": user_id}, {"_id": 0, "password": 0, "searchKeys": 0})
     if user:
         return jsonify(user)
     return jsonify({"error": "User not found"}), 404
@@ -203,14 +2434,21 @@ def update_user_profile():
         "lastName": data.get("lastName"),
         "age": data.get("age"),
         "contactNumber": data.get("contactNumber"),
-        "emergencyContact": data.get("emergencyContact")
+        "emergencyContact": data.get("emergencyContact"),
+        "aiResponseCache": data.get("aiResponseCache") # False opts out of shared AI reply caching
     }
     update_data = {k: v for k, v in update_data.items() if v is not None}
 
-    result = users_collection.update_one({"user_id": user_id}, {"$set": update_data})
+    updated_user = users_collection.find_one_and_update(
+        {"user_id": user_id}, {"$set": update_data},
+        projection={"_id": 0, "password": 0, "searchKeys": 0}, return_document=ReturnDocument.AFTER
+    )
     
-    if result.matched_count > 0:
-        updated_user = users_collection.find_one({"user_id": user_id}, {"_id": 0, "password": 0})
+    if updated_user is not None:
+        profile_cache.pop(user_id)
+        bump_stats({"usersVersion": 1})
+        if "firstName" in update_data or "lastName" in update_data:
+            users_collection.update_one({"user_id": user_id}, {"$set": {"searchKeys": search_keys_for(updated_user)}})
         return jsonify({"success": True, "message": "Profile updated", "user": updated_user})
     
     return jsonify({"error": "User not found"}), 404
@@ -219,6 +2457,7 @@ def update_user_profile():
 #           WELLNESS TRACKING ROUTES 
 # --------------------------------------------------
 @app.route("/wellness/<user_id>", methods=["GET"])
+@conditional()
 def get_wellness(user_id):
     if users_collection is None: return jsonify({"error": "DB error"}), 500
     user = users_collection.find_one({"user_id": user_id}, {"_id": 0, "wellnessProfile": 1})
@@ -235,25 +2474,49 @@ def update_wellness(user_id):
     if score is None: 
         return jsonify({"error": "Score is required"}), 400
 
+    now = datetime.datetime.now(timezone.utc)
     wellness_data = {
         "score": score,
-        "lastUpdate": datetime.datetime.now(timezone.utc).isoformat()
+        "lastUpdate": now.isoformat()
     }
     
-    result = users_collection.update_one(
+    previous = users_collection.find_one_and_update(
         {"user_id": user_id}, 
-        {"$set": {"wellnessProfile": wellness_data}}
+        {"$set": {"wellnessProfile": wellness_data}},
+        projection={"_id": 0, "user_id": 1, "firstName": 1, "lastName": 1, "wellnessProfile.score": 1}
     )
     
-    if result.matched_count > 0:
+    if previous is not None:
+        old_score = previous.get("wellnessProfile", {}).get("score")
+        bump_stats(score_counters(old_score, -1), score_counters(score, 1), {"usersVersion": 1})
+        record_checkin(score)
+        evaluate_wellness_rules(previous, old_score, score, now) # Judged against the window before this sample
+        record_wellness_sample(user_id, score, now)
         return jsonify({"success": True, "message": "Wellness score updated", "wellnessProfile": wellness_data})
     
     return jsonify({"error": "User not found"}), 404
 
+@app.route("/wellness/<user_id>/history", methods=["GET"])
+def get_wellness_history(user_id):
+    if wellness_series_collection is None: return jsonify({"error": "DB error"}), 500
+    since = datetime.datetime.now(timezone.utc) - datetime.timedelta(days=parse_days(request.args.get("days"), 30))
+    return jsonify(wellness_history(user_id, since, parse_page_size(request.args.get("limit"))))
+
+@app.route("/wellness/<user_id>/trend", methods=["GET"])
+def get_wellness_trend(user_id):
+    if wellness_series_collection is None: return jsonify({"error": "DB error"}), 500
+    days = parse_days(request.args.get("days"), 30)
+    window = parse_days(request.args.get("window"), 7)
+    since = datetime.datetime.now(timezone.utc) - datetime.timedelta(days=days)
+    trend = wellness_trend(wellness_daily(user_id, since), window)
+    trend.update({"user_id": user_id, "rangeDays": days, "window": window})
+    return jsonify(trend)
+
 # --------------------------------------------------
 #               FRIEND SYSTEM ROUTES
 # --------------------------------------------------
 @app.route("/users/search", methods=["POST"])
+@rate_limited("search")
 def search_users():
     if users_collection is None: return jsonify([])
     data = request.json
@@ -261,34 +2524,36 @@ def search_users():
     current_user_id = data.get("user_id")
 
     if not query: return jsonify([])
-    regex = {"$regex": query, "$options": "i"}
+    limit = parse_bounded_int(data.get("limit"), SEARCH_RESULT_LIMIT, 1, SEARCH_MAX_LIMIT)
+    offset = parse_bounded_int(data.get("offset"), 0, 0)
     
     users = list(users_collection.find(
-        {
-            "$and": [
-                {"user_id": {"$ne": current_user_id}},
-                {"$or": [{"email": regex}, {"firstName": regex}, {"lastName": regex}]}
-            ]
-        },
-        {"_id": 0, "user_id": 1, "firstName": 1, "lastName": 1, "email": 1, "friends": 1}
-    ))
-
-    current_user = users_collection.find_one({"user_id": current_user_id})
-    my_friends = current_user.get("friends", []) if current_user else []
+        {"$and": [{"user_id": {"$ne": current_user_id}}] + search_keys_clauses(query)},
+        {"_id": 0, "user_id": 1, "firstName": 1, "lastName": 1, "email": 1}
+    ).sort("_id", 1).skip(offset).limit(limit)) # A stable order, or offset pages could repeat or skip users
+    if not users: return jsonify([])
+
+    # Friendship for this page only: an indexed edge lookup instead of loading the whole friend list
+    page_ids = [u["user_id"] for u in users]
+    my_friends = {e["friend_id"] for e in friendships_collection.find(
+        {"user_id": current_user_id, "friend_id": {"$in": page_ids}}, {"_id": 0, "friend_id": 1}
+    )}
+
+    # Resolve pending status for the whole page in one query
+    others = [u["user_id"] for u in users if u["user_id"] not in my_friends]
+    pending_with = set()
+    if others:
+        for req in friend_requests_collection.find({"status": "pending", "$or": [
+            {"sender_id": current_user_id, "receiver_id": {"$in": others}},
+            {"sender_id": {"$in": others}, "receiver_id": current_user_id}
+        ]}, {"_id": 0, "sender_id": 1, "receiver_id": 1}):
+            pending_with.add(req["receiver_id"] if req["sender_id"] == current_user_id else req["sender_id"])
 
     results = []
     for u in users:
         status = "none"
-        if u["user_id"] in my_friends:
-            status = "friend"
-        else:
-            pending = friend_requests_collection.find_one({
-                "$or": [
-                    {"sender_id": current_user_id, "receiver_id": u["user_id"], "status": "pending"},
-                    {"sender_id": u["user_id"], "receiver_id": current_user_id, "status": "pending"}
-                ]
-            })
-            if pending: status = "pending"
+        if u["user_id"] in my_friends: status = "friend"
+        elif u["user_id"] in pending_with: status = "pending"
         
         results.append({
             "user_id": u["user_id"],
@@ -306,8 +2571,9 @@ def send_friend_request():
     sender_id = data.get("sender_id")
     receiver_id = data.get("receiver_id")
 
-    sender = users_collection.find_one({"user_id": sender_id})
-    if receiver_id in sender.get("friends", []):
+    if not sender_id or not receiver_id or sender_id == receiver_id:
+        return jsonify({"error": "Invalid request"}), 400
+    if are_friends(sender_id, receiver_id):
         return jsonify({"error": "Already friends"}), 400
 
     existing = friend_requests_collection.find_one({
@@ -319,15 +2585,18 @@ def send_friend_request():
         "request_id": str(uuid.uuid4()), "sender_id": sender_id, "receiver_id": receiver_id,
         "status": "pending", "timestamp": datetime.datetime.now(timezone.utc)
     })
+    suggestion_cache.pop(sender_id)
+    suggestion_cache.pop(receiver_id)
     return jsonify({"success": True, "message": "Friend request sent"})
 
 @app.route("/friend-request/pending/<user_id>", methods=["GET"])
 def get_pending_requests(user_id):
     if friend_requests_collection is None: return jsonify([])
-    requests = list(friend_requests_collection.find({"receiver_id": user_id, "status": "pending"}))
+    requests = list(friend_requests_collection.find({"receiver_id": user_id, "status": "pending"}, {"_id": 0}))
+    senders = hydrate_users([req["sender_id"] for req in requests])
     results = []
     for req in requests:
-        sender = users_collection.find_one({"user_id": req["sender_id"]})
+        sender = senders.get(req["sender_id"])
         if sender:
             results.append({
                 "request_id": req["request_id"], "sender_id": sender["user_id"],
@@ -345,25 +2614,43 @@ def accept_friend_request():
     req = friend_requests_collection.find_one({"request_id": request_id})
     if not req: return jsonify({"error": "Request not found"}), 404
 
+    # Safe to retry: the edges are written even if the request was already accepted
     friend_requests_collection.update_one({"request_id": request_id}, {"$set": {"status": "accepted"}})
-    users_collection.update_one({"user_id": req["sender_id"]}, {"$push": {"friends": req["receiver_id"]}})
-    users_collection.update_one({"user_id": req["receiver_id"]}, {"$push": {"friends": req["sender_id"]}})
+    add_friendships([(req["sender_id"], req["receiver_id"])], datetime.datetime.now(timezone.utc))
+    invalidate_suggestions(req["sender_id"], req["receiver_id"])
 
     return jsonify({"success": True, "message": "Friend request accepted"})
 
 @app.route("/friends/list/<user_id>", methods=["GET"])
+@conditional()
 def get_friends_list(user_id):
     if users_collection is None: return jsonify([])
-    user = users_collection.find_one({"user_id": user_id})
-    if not user: return jsonify([])
-
-    friend_ids = user.get("friends", [])
+    friend_ids = friends_of(user_id)
     if not friend_ids: return jsonify([])
 
     friends = list(users_collection.find({"user_id": {"$in": friend_ids}}, {"_id": 0, "user_id": 1, "firstName": 1, "lastName": 1, "email": 1}))
     results = [{"id": f["user_id"], "name": f"{f.get('firstName')} {f.get('lastName')}", "email": f["email"]} for f in friends]
     return jsonify(results)
 
+@app.route("/friends/suggestions/<user_id>", methods=["GET"])
+def get_friend_suggestions(user_id):
+    """People you may know: non-friends ranked by mutual friends (cached per user until the graph changes)."""
+    if friendships_collection is None: return jsonify([])
+    limit = parse_bounded_int(request.args.get("limit"), SUGGESTION_LIMIT, 1, SUGGESTION_MAX_LIMIT)
+    suggestions = friend_suggestions(user_id)[:limit]
+    profiles = hydrate_users([candidate for candidate, _ in suggestions])
+    results = []
+    for candidate, mutual in suggestions:
+        profile = profiles.get(candidate)
+        if profile:
+            results.append({
+                "user_id": candidate,
+                "name": f"{profile.get('firstName', '')} {profile.get('lastName', '')}".strip(),
+                "email": profile.get("email"),
+                "mutualFriends": mutual
+            })
+    return jsonify(results)
+
 
 # --------------------------------------------------
 #              GROUP CHAT ROUTES (NEW)
@@ -388,24 +2675,31 @@ def create_group():
     return jsonify({"success": True, "message": "Group created", "group": {"id": group_data["group_id"], "name": group_data["name"]}})
 
 @app.route("/groups/list/<user_id>", methods=["GET"])
+@conditional()
 def list_groups(user_id):
     if groups_collection is None: return jsonify([])
     groups = list(groups_collection.find({"members": user_id}, {"_id": 0, "group_id": 1, "name": 1, "members": 1}))
     results = [{"id": g["group_id"], "name": g["name"], "member_count": len(g["members"])} for g in groups]
     return jsonify(results)
 
+def group_messages_version(group_id):
+    if conversations_collection is None: return None
+    summary = conversations_collection.find_one({"_id": group_channel(group_id)}, {"message_count": 1, "timestamp": 1}) or {}
+    return summary.get("message_count", 0), summary.get("timestamp")
+
 @app.route("/groups/messages/<group_id>", methods=["GET"])
+@conditional(group_messages_version)
 def get_group_messages(group_id):
     if group_messages_collection is None: return jsonify([])
-    messages = list(group_messages_collection.find({"group_id": group_id}, {"_id": 0}).sort("timestamp", 1))
-    return jsonify(messages)
+    if not request.args.get("since"): rehydrate("group", {"_id": group_channel(group_id)})
+    return jsonify(paginate_messages(group_messages_collection, {"group_id": group_id}, request.args))
 
 @app.route("/groups/send", methods=["POST"])
 def send_group_message():
     if group_messages_collection is None: return jsonify({"error": "DB error"}), 500
     data = request.json
     sender_id = data.get("sender_id")
-    sender = users_collection.find_one({"user_id": sender_id})
+    sender = hydrate_users([sender_id]).get(sender_id)
     sender_name = f"{sender.get('firstName')} {sender.get('lastName')}" if sender else "Unknown"
 
     msg_data = {
@@ -413,9 +2707,15 @@ def send_group_message():
         "sender_id": sender_id, "sender_name": sender_name,
         "text": data.get("text"), "timestamp": datetime.datetime.now(timezone.utc).isoformat()
     }
-    group_messages_collection.insert_one(msg_data)
+    group_messages_collection.insert_one(dict(msg_data))
+    touch_conversation(group_channel(msg_data["group_id"]), "group", group_members(msg_data["group_id"]), msg_data)
+    broker.publish(group_channel(msg_data["group_id"]), msg_data)
     return jsonify({"success": True, "message": msg_data})
 
+@app.route("/groups/stream/<group_id>", methods=["GET"])
+def stream_group_messages(group_id):
+    return sse_response(group_channel(group_id))
+
 
 # --------------------------------------------------
 #              P2P CHAT ROUTES
@@ -426,13 +2726,15 @@ def get_p2p_messages():
     data = request.json
     user_id = data.get("user_id")
     friend_id = data.get("friend_id")
+    if not valid_ids(user_id, friend_id): return jsonify({"error": "user_id and friend_id are required"}), 400
+    if not data.get("since"): rehydrate("p2p", {"_id": p2p_channel(user_id, friend_id)}) # Polls only need hot messages
 
-    messages = list(p2p_messages_collection.find({
+    messages = paginate_messages(p2p_messages_collection, {
         "$or": [
             {"sender_id": user_id, "receiver_id": friend_id},
             {"sender_id": friend_id, "receiver_id": user_id}
         ]
-    }, {"_id": 0}).sort("timestamp", 1))
+    }, data)
 
     return jsonify(messages)
 
@@ -440,33 +2742,263 @@ def get_p2p_messages():
 def send_p2p_message():
     if p2p_messages_collection is None: return jsonify({"error": "DB error"}), 500
     data = request.json
-    
+    if not valid_ids(data.get("sender_id"), data.get("receiver_id")):
+        return jsonify({"error": "sender_id and receiver_id are required"}), 400
+
     msg_data = {
         "message_id": str(uuid.uuid4()), "sender_id": data.get("sender_id"),
         "receiver_id": data.get("receiver_id"), "text": data.get("text"),
         "timestamp": datetime.datetime.now(timezone.utc).isoformat(), "read": False
     }
 
-    p2p_messages_collection.insert_one(msg_data)
+    p2p_messages_collection.insert_one(dict(msg_data))
+    channel = p2p_channel(msg_data["sender_id"], msg_data["receiver_id"])
+    touch_conversation(channel, "p2p", sorted([msg_data["sender_id"], msg_data["receiver_id"]]), msg_data)
+    broker.publish(channel, msg_data)
     return jsonify({"success": True, "message": msg_data})
 
+@app.route("/p2p/stream/<user_id>/<friend_id>", methods=["GET"])
+def stream_p2p_messages(user_id, friend_id):
+    return sse_response(p2p_channel(user_id, friend_id))
+
+# --------------------------------------------------
+#              INBOX ROUTES
+# --------------------------------------------------
+@app.route("/inbox/<user_id>", methods=["GET"])
+@conditional()
+def get_inbox(user_id):
+    """Every friend and group with last message and unread count, in one call."""
+    if users_collection is None: return jsonify({"error": "DB error"}), 500
+    user = users_collection.find_one({"user_id": user_id}, {"_id": 1})
+    if not user: return jsonify({"error": "User not found"}), 404
+
+    conversations = {
+        c["_id"]: c for c in conversations_collection.find(
+            {"members": user_id}, {"type": 1, "last_message": 1, "timestamp": 1, f"unread.{user_id}": 1}
+        )
+    }
+    profiles = hydrate_users(friends_of(user_id))
+    friends = [
+        inbox_entry({"id": f["user_id"], "name": f"{f.get('firstName')} {f.get('lastName')}", "email": f.get("email")},
+                    conversations.get(p2p_channel(user_id, f["user_id"])), user_id)
+        for f in profiles.values()
+    ]
+    groups = [
+        inbox_entry({"id": g["group_id"], "name": g["name"], "member_count": len(g["members"])},
+                    conversations.get(group_channel(g["group_id"])), user_id)
+        for g in groups_collection.find({"members": user_id}, {"_id": 0, "group_id": 1, "name": 1, "members": 1})
+    ]
+    return jsonify({
+        "friends": by_recent_activity(friends),
+        "groups": by_recent_activity(groups),
+        "unreadTotal": sum(e["unread"] for e in friends + groups)
+    })
+
+@app.route("/inbox/read", methods=["POST"])
+def mark_inbox_read():
+    """Bulk mark-read: {"user_id", "friends": [ids], "groups": [ids]} resets those unread counters."""
+    if conversations_collection is None: return jsonify({"error": "DB error"}), 500
+    data = request.json or {}
+    user_id = data.get("user_id")
+    friend_ids = data.get("friends") or []
+    group_ids = data.get("groups") or []
+    if not user_id: return jsonify({"error": "user_id is required"}), 400
+
+    conversation_ids = [p2p_channel(user_id, f) for f in friend_ids] + [group_channel(g) for g in group_ids]
+    if conversation_ids:
+        conversations_collection.update_many({"_id": {"$in": conversation_ids}}, {"$set": {f"unread.{user_id}": 0}})
+    if friend_ids:
+        p2p_messages_collection.update_many(
+            {"sender_id": {"$in": friend_ids}, "receiver_id": user_id, "read": False}, {"$set": {"read": True}}
+        )
+    return jsonify({"success": True, "marked": len(conversation_ids)})
+
 # --------------------------------------------------
-#           EMOTION DETECTION (SIMULATED)
+#               EMOTION DETECTION
 # --------------------------------------------------
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+EMOTION_FACE_MODEL = os.getenv("EMOTION_FACE_MODEL", os.path.join(MODELS_DIR, "face_detection_yunet_2023mar.onnx"))
+EMOTION_MODEL = os.getenv("EMOTION_MODEL", os.path.join(MODELS_DIR, "emotion-ferplus-8.onnx"))
+EMOTION_MAX_WIDTH = 320
+EMOTION_BATCH_SIZE = int(os.getenv("EMOTION_BATCH_SIZE", "16"))
+EMOTION_BATCH_WAIT = float(os.getenv("EMOTION_BATCH_WAIT_MS", "10")) / 1000
+EMOTION_DIFF_THRESHOLD = float(os.getenv("EMOTION_DIFF_THRESHOLD", "4.0")) # Mean abs pixel change (0-255)
+EMOTION_TIMEOUT_SECONDS = 2.0
+EMOTION_FACE_DETECTORS = int(os.getenv("EMOTION_FACE_DETECTORS", str(min(4, os.cpu_count() or 1))))
+cv2 = None # OpenCV and numpy are imported by load_emotion_detector()
+np = None
+
+class InvalidImage(ValueError):
+    """The client sent something that is not a decodable image; answered with 400."""
+
+class EmotionDetector:
+    """CPU pipeline: decode -> downscale -> skip unchanged frames -> YuNet face -> batched FER+ expression."""
+
+    # FER+ output order, mapped to the labels the frontend and /chat already use
+    LABELS = ["neutral", "happy", "surprise", "sad", "angry", "disgust", "fear", "contempt"]
+    STAGES = ("decode", "resize", "face", "classify", "total")
+
+    def __init__(self, face_model_path, emotion_model_path):
+        self.net = cv2.dnn.readNetFromONNX(emotion_model_path) # Only touched by the batch thread
+        # FaceDetectorYN keeps per-call state (input size), so requests borrow one from a fixed pool;
+        # the dev server starts a thread per request, so per-thread detectors would reload the model
+        self._faces = queue.Queue()
+        for _ in range(max(EMOTION_FACE_DETECTORS, 1)):
+            self._faces.put(cv2.FaceDetectorYN.create(face_model_path, "", (EMOTION_MAX_WIDTH, 240), 0.7))
+        self._requests = queue.Queue()
+        self._last_frames = TTLCache(maxsize=5000, ttl=30)
+        self._lock = threading.Lock()
+        self._stage_seconds = {stage: 0.0 for stage in self.STAGES}
+        self._stage_counts = {stage: 0 for stage in self.STAGES}
+        self.counters = {"frames": 0, "skipped": 0, "noFace": 0, "batches": 0, "batchedFaces": 0}
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+
+    def _detect_faces(self, frame):
+        height, width = frame.shape[:2]
+        detector = self._faces.get()
+        try:
+            detector.setInputSize((width, height))
+            return detector.detect(frame)[1]
+        finally:
+            self._faces.put(detector)
+
+    def _record(self, stage, started):
+        with self._lock:
+            self._stage_seconds[stage] += time.perf_counter() - started
+            self._stage_counts[stage] += 1
+
+    def _count(self, name, amount=1):
+        with self._lock: self.counters[name] += amount
+
+    def detect(self, image_bytes, stream_key):
+        started = time.perf_counter()
+        self._count("frames")
+
+        stage = time.perf_counter()
+        frame = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None: raise InvalidImage("Could not decode image")
+        self._record("decode", stage)
+
+        stage = time.perf_counter()
+        height, width = frame.shape[:2]
+        if width > EMOTION_MAX_WIDTH:
+            scale = EMOTION_MAX_WIDTH / width
+            frame = cv2.resize(frame, (EMOTION_MAX_WIDTH, int(height * scale)), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        thumb = cv2.resize(gray, (32, 24), interpolation=cv2.INTER_AREA)
+        self._record("resize", stage)
+
+        # A camera pointed at a still face sends near-identical frames; reuse the last answer
+        last = self._last_frames.get(stream_key)
+        if last is not None and float(np.mean(cv2.absdiff(thumb, last[0]))) < EMOTION_DIFF_THRESHOLD:
+            self._count("skipped")
+            return dict(last[1], cached=True)
+
+        stage = time.perf_counter()
+        faces = self._detect_faces(frame)
+        self._record("face", stage)
+
+        if faces is None or len(faces) == 0:
+            self._count("noFace")
+            result = {"top_emotion": "neutral", "confidence": 0.0, "face": False}
+        else:
+            x, y, w, h = (int(v) for v in max(faces, key=lambda f: f[2] * f[3])[:4])
+            crop = gray[max(y, 0):max(y, 0) + h, max(x, 0):max(x, 0) + w]
+            stage = time.perf_counter()
+            pending = Future()
+            self._requests.put((cv2.resize(crop, (64, 64), interpolation=cv2.INTER_AREA), pending))
+            result = pending.result(timeout=EMOTION_TIMEOUT_SECONDS)
+            self._record("classify", stage)
+
+        self._last_frames.set(stream_key, (thumb, result))
+        self._record("total", started)
+        return result
+
+    def _batch_loop(self):
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.monotonic() + EMOTION_BATCH_WAIT
+            while len(batch) < EMOTION_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: break
+                try:
+                    batch.append(self._requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                # FER+ takes raw 0-255 grayscale, N x 1 x 64 x 64
+                self.net.setInput(cv2.dnn.blobFromImages([face for face, _ in batch]))
+                scores = self.net.forward().reshape(len(batch), -1)
+                probs = np.exp(scores - scores.max(axis=1, keepdims=True))
+                probs /= probs.sum(axis=1, keepdims=True)
+                for (_, pending), row in zip(batch, probs):
+                    best = int(row.argmax())
+                    pending.set_result({"top_emotion": self.LABELS[best], "confidence": round(float(row[best]) * 100, 1), "face": True})
+                self._count("batches")
+                self._count("batchedFaces", len(batch))
+            except Exception as e:
+                for _, pending in batch:
+                    if not pending.done(): pending.set_exception(e)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["stageMs"] = {
+                stage: round(1000 * self._stage_seconds[stage] / self._stage_counts[stage], 2)
+                for stage in self.STAGES if self._stage_counts[stage]
+            }
+        stats["avgBatchSize"] = round(stats["batchedFaces"] / stats["batches"], 2) if stats["batches"] else 0
+        return stats
+
+def load_emotion_detector():
+    global cv2, np
+    try:
+        import cv2
+        import numpy as np
+    except ImportError:
+        cv2 = np = None
+    if cv2 is None or not hasattr(cv2, "FaceDetectorYN"):
+        print("⚠️ OpenCV (4.5.4+) not installed; emotion detection disabled")
+        return None
+    for path in (EMOTION_FACE_MODEL, EMOTION_MODEL):
+        if not os.path.exists(path):
+            print(f"⚠️ Emotion model not found at {path}; emotion detection disabled (run download_models.py)")
+            return None
+    try:
+        detector = EmotionDetector(EMOTION_FACE_MODEL, EMOTION_MODEL)
+        print("✅ Emotion models loaded")
+        return detector
+    except Exception as e:
+        print("❌ Emotion model error:", e)
+        return None
+
+emotion_detector = None # Loaded in the background by warm_up()
+
+def decode_image_payload(value):
+    # The camera sends a data URL: "data:image/jpeg;base64,...."
+    if not value: return None
+    if not isinstance(value, str): raise InvalidImage("Image must be a base64 string")
+    if "," in value: value = value.split(",", 1)[1]
+    try:
+        return base64.b64decode(value)
+    except (binascii.Error, ValueError):
+        raise InvalidImage("Image is not valid base64")
 
 @app.route("/detect_emotion", methods=["POST"])
+@rate_limited("emotion")
 def detect_emotion():
+    if emotion_detector is None:
+        return jsonify({"status": "error", "message": "Emotion detection unavailable"}), 503
     try:
-        data = request.json
-        emotions = ['happy', 'sad', 'neutral', 'neutral', 'neutral']
-        detected = random.choice(emotions) 
-        confidence = random.uniform(60.0, 95.0)
-
-        return jsonify({
-            "status": "success",
-            "top_emotion": detected,
-            "confidence": confidence
-        })
+        data = request.json or {}
+        image = decode_image_payload(data.get("image"))
+        if not image: return jsonify({"status": "error", "message": "No image"}), 400
+
+        stream_key = f"{data.get('user_id')}:{data.get('session_id')}"
+        result = emotion_detector.detect(image, stream_key)
+        return jsonify(dict(result, status="success"))
+    except InvalidImage as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         print("Emotion Error:", e)
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -474,160 +3006,575 @@ def detect_emotion():
 # --------------------------------------------------
 #             AI CHAT ROUTES 
 # --------------------------------------------------
-@app.route("/chat", methods=["POST"])
-def chat():
-    data = request.json or {}
+def llm_slot_owner(user_id):
+    # Guests share a placeholder id; their concurrent-reply cap applies per address instead
+    return client_address() if user_id in PLACEHOLDER_USER_IDS else user_id
+
+def prepare_chat_turn(data):
+    # Shared by /chat and /chat/stream; read-only, the exchange is persisted once it's served
     user_message = data.get("message")
     user_id = data.get("user_id", "user_1")
     session_id = data.get("session_id") or str(uuid.uuid4())
     emotion = data.get("emotion") 
+    received_at = datetime.datetime.now(timezone.utc)
 
-    if not user_message: return jsonify({"error": "No message"}), 400
-
-    if messages_collection is not None:
-        messages_collection.insert_one({
-            "user_id": user_id, "session_id": session_id,
-            "sender": "user", "message": user_message,
-            "timestamp": datetime.datetime.now(timezone.utc)
-        })
-
-    user_memory = get_user_memory(user_id)
-    history = get_chat_history(session_id, user_id)
+    # Read context before storing this message so it isn't sent to the model twice
+    history = []
+    if data.get("session_id"):
+        rehydrate("ai_chat", {"user_id": user_id, "session_id": session_id})
+        history = assemble_context(user_id, session_id, user_message)
     
     context_message = user_message
     if emotion and emotion != "neutral":
         if "[SYSTEM:" not in user_message:
             context_message = f"[Visual Context: The user looks {emotion}] {user_message}"
     
-    model = genai.GenerativeModel("gemini-2.5-flash", system_instruction=get_ai_persona(user_memory))
-    chat_session = model.start_chat(history=history)
-    
-    response = chat_session.send_message(context_message)
-    
-    if messages_collection is not None:
-        messages_collection.insert_one({
-            "user_id": user_id, "session_id": session_id,
-            "sender": "ai", "message": response.text,
-            "timestamp": datetime.datetime.now(timezone.utc)
+    persona, model = get_persona_model(user_id)
+    turn = {
+        "user_id": user_id, "session_id": session_id, "user_message": user_message, "received_at": received_at,
+        "history": history, "message": context_message, "model": model,
+        "persona_hash": hashlib.sha1(persona.encode("utf-8")).hexdigest(),
+        "expires_at": received_at + TEMP_CHAT_TTL if data.get("temporary") else None # Removed by the TTL index
+    }
+    turn["cacheable"] = response_cacheable(turn, data)
+    return turn
+
+def persist_exchange(turn, reply=None):
+    # The user's message and Aura's reply go to Mongo together in one batch
+    if messages_collection is None: return
+    record_activity(turn["session_id"])
+    docs = [{
+        "message_id": str(uuid.uuid4()), "user_id": turn["user_id"], "session_id": turn["session_id"],
+        "sender": "user", "message": turn["user_message"], "timestamp": turn["received_at"]
+    }]
+    if reply:
+        docs.append({
+            "message_id": str(uuid.uuid4()), "user_id": turn["user_id"], "session_id": turn["session_id"],
+            "sender": "ai", "message": reply, "timestamp": datetime.datetime.now(timezone.utc)
         })
+    if turn["expires_at"]:
+        for doc in docs: doc["expiresAt"] = turn["expires_at"]
+    message_writer.insert(messages_collection, docs)
+    touch_chat_session(turn["user_id"], turn["session_id"], docs[-1]["message"], docs[-1]["timestamp"], len(docs), turn["expires_at"])
 
-    return jsonify({"reply": response.text, "session_id": session_id})
+def cached_reply(turn):
+    if not turn["cacheable"]: return None
+    reply = response_cache.get(turn["persona_hash"], turn["message"])
+    if reply is not None: persist_exchange(turn, reply)
+    return reply
+
+def remember_reply(turn, reply):
+    if turn["cacheable"] and reply: response_cache.set(turn["persona_hash"], turn["message"], reply)
+
+@app.route("/chat", methods=["POST"])
+@rate_limited("chat")
+def chat():
+    data = request.json or {}
+    if not data.get("message"): return jsonify({"error": "No message"}), 400
+
+    turn = prepare_chat_turn(data)
+    reply = cached_reply(turn)
+    if reply is not None:
+        return jsonify({"reply": reply, "session_id": turn["session_id"]})
+
+    try:
+        with llm_executor.admit(llm_slot_owner(turn["user_id"])) as admission:
+            chat_session = turn["model"].start_chat(history=turn["history"])
+            response = llm_executor.run(admission, chat_session.send_message, turn["message"])
+    except LLMRejected as e:
+        if e.status == 504: persist_exchange(turn) # The message did reach the model
+        return llm_rejection(e)
+    persist_exchange(turn, response.text)
+    remember_reply(turn, response.text)
+
+    return jsonify({"reply": response.text, "session_id": turn["session_id"]})
+
+@app.route("/chat/stream", methods=["POST"])
+@rate_limited("chat")
+def chat_stream():
+    data = request.json or {}
+    if not data.get("message"): return jsonify({"error": "No message"}), 400
+
+    turn = prepare_chat_turn(data)
+    reply = cached_reply(turn)
+    if reply is not None:
+        events = [
+            sse_event({"session_id": turn["session_id"]}, event="session"),
+            sse_event({"delta": reply}),
+            sse_event({"reply": reply, "session_id": turn["session_id"]}, event="done")
+        ]
+        return Response(events, mimetype="text/event-stream", headers=SSE_HEADERS)
+
+    try:
+        with llm_executor.admit(llm_slot_owner(turn["user_id"])) as admission:
+            chat_session = turn["model"].start_chat(history=turn["history"])
+            chunks = llm_executor.stream(admission, functools.partial(chat_session.send_message, stream=True), turn["message"])
+    except LLMRejected as e:
+        return llm_rejection(e)
+
+    def generate():
+        yield sse_event({"session_id": turn["session_id"]}, event="session")
+        parts = []
+        try:
+            for chunk in chunks:
+                if not chunk.text: continue
+                parts.append(chunk.text)
+                yield sse_event({"delta": chunk.text})
+            remember_reply(turn, "".join(parts))
+            yield sse_event({"reply": "".join(parts), "session_id": turn["session_id"]}, event="done")
+        except LLMRejected as e:
+            yield sse_event({"error": e.message}, event="error")
+        except Exception as e:
+            print("Chat stream error:", e)
+            yield sse_event({"error": "AI response failed"}, event="error")
+        finally:
+            # Runs on completion or client disconnect, so history matches what was shown
+            persist_exchange(turn, "".join(parts))
+
+    return Response(generate(), mimetype="text/event-stream", headers=SSE_HEADERS)
 
 @app.route("/sessions/<user_id>", methods=["GET"])
 def get_sessions(user_id):
-    if messages_collection is None: return jsonify([])
-    pipeline = [
-        {"$match": {"user_id": user_id}},
-        {"$sort": {"timestamp": -1}},
-        {"$group": {"_id": "$session_id", "last_message": {"$first": "$message"}, "timestamp": {"$first": "$timestamp"}}},
-        {"$sort": {"timestamp": -1}}
-    ]
-    sessions = list(messages_collection.aggregate(pipeline))
-    return jsonify([{"session_id": s["_id"], "preview": s["last_message"][:30] + "...", "timestamp": s["timestamp"]} for s in sessions])
+    if chat_sessions_collection is None: return jsonify([])
+    query = {"user_id": user_id}
+    before = parse_cursor_time(request.args.get("before"), True)
+    if before: query["timestamp"] = {"$lt": before}
+    sessions = chat_sessions_collection.find(
+        query, {"_id": 0, "session_id": 1, "last_message": 1, "timestamp": 1}
+    ).sort("timestamp", -1).limit(parse_page_size(request.args.get("limit")))
+    return jsonify([{"session_id": s["session_id"], "preview": s["last_message"][:30] + "...", "timestamp": cursor_timestamp(s["timestamp"])} for s in sessions])
 
 @app.route("/sessions/<session_id>", methods=["DELETE"])
 def delete_session(session_id):
-    if messages_collection is not None:
-        messages_collection.delete_many({"session_id": session_id})
-        return jsonify({"success": True})
-    return jsonify({"error": "DB error"}), 500
+    # Every delete is keyed by an indexed field: session_id prefixes the messages index and has its
+    # own on chat_sessions, and summaries are removed by _id
+    if messages_collection is None: return jsonify({"error": "DB error"}), 500
+    message_writer.flush() # Buffered messages would otherwise land after the delete
+    user_ids = []
+    if chat_sessions_collection is not None:
+        user_ids = chat_sessions_collection.distinct("user_id", {"session_id": session_id})
+        delete_archived("ai_chat", {"session_id": session_id})
+        if chat_sessions_collection.delete_many({"session_id": session_id}).deleted_count:
+            bump_stats({"sessionsVersion": 1}) # Admin session counts changed
+    result = messages_collection.delete_many({"session_id": session_id})
+    if user_ids and session_summaries_collection is not None:
+        keys = [summary_key(user_id, session_id) for user_id in user_ids]
+        session_summaries_collection.delete_many({"_id": {"$in": keys}})
+        for key in keys: summary_cache.pop(key)
+    return jsonify({"success": True, "deleted": result.deleted_count})
 
 @app.route("/history/<session_id>", methods=["GET"])
 def get_session_history(session_id):
     if messages_collection is None: return jsonify([])
-    return jsonify(list(messages_collection.find({"session_id": session_id}, {"_id": 0}).sort("timestamp", 1)))
+    if not request.args.get("since"): rehydrate("ai_chat", {"session_id": session_id})
+    messages = paginate_messages(messages_collection, {"session_id": session_id}, request.args, timestamps_are_datetimes=True)
+    for message in messages: message["timestamp"] = cursor_timestamp(message.get("timestamp"))
+    return jsonify(messages)
 
 
 # --------------------------------------------------
 #          ADMIN DASHBOARD ROUTES (NEW)
 # --------------------------------------------------
 @app.route("/admin/stats", methods=["GET"])
+@rate_limited("admin")
+@coalesced
 def admin_stats():
     if users_collection is None: return jsonify({"error": "DB error"}), 500
-    
-    # 1. Total users
-    total_users = users_collection.count_documents({})
-    
-    # 2. High risk users (wellness < 50)
-    high_risk_count = users_collection.count_documents({"wellnessProfile.score": {"$lt": 50}})
-    
-    # 3. Average Wellness Score
-    pipeline = [
-        {"$match": {"wellnessProfile.score": {"$type": "number"}}},
-        {"$group": {"_id": None, "avg_score": {"$avg": "$wellnessProfile.score"}}}
-    ]
-    avg_result = list(users_collection.aggregate(pipeline))
-    avg_score = round(avg_result[0]["avg_score"], 1) if avg_result and avg_result[0].get("avg_score") else 0
-    
-    # 4. Active Sessions in the last 24 hours
-    active_sessions = 0
-    if messages_collection is not None:
-        yesterday = datetime.datetime.now(timezone.utc) - datetime.timedelta(days=1)
-        active_sessions = len(messages_collection.distinct("session_id", {"timestamp": {"$gte": yesterday}}))
+    stats = load_stats()
+    scored = stats.get("scoredUsers", 0)
+    yesterday = datetime.datetime.now(timezone.utc) - datetime.timedelta(days=1)
     
     return jsonify({
-        "totalUsers": total_users,
-        "highRisk": high_risk_count,
-        "avgScore": avg_score,
-        "activeSessions": active_sessions
+        "totalUsers": stats.get("totalUsers", 0),
+        "highRisk": stats.get("highRisk", 0),
+        "avgScore": round(stats.get("scoreSum", 0) / scored, 1) if scored else 0,
+        "activeSessions": active_sessions_since(yesterday)
     })
 
-@app.route("/admin/users", methods=["GET"])
-def admin_users():
-    if users_collection is None: return jsonify([])
-    users = list(users_collection.find({}, {"_id": 0, "password": 0}))
-    
-    results = []
-    for u in users:
-        score = u.get("wellnessProfile", {}).get("score", 0)
-        risk_level = "low"
-        if score < 50: risk_level = "high"
-        elif score < 75: risk_level = "medium"
+def component_stats():
+    return {
+        "llm": llm_executor.stats(),
+        "context": get_context_metrics(),
+        "responseCache": response_cache.stats(),
+        "emotion": emotion_detector.stats() if emotion_detector is not None else None,
+        "personaCache": persona_cache.stats(),
+        "profileCache": profile_cache.stats(),
+        "suggestionCache": suggestion_cache.stats(),
+        "retention": retention_stats,
+        "rateLimits": rate_limiter.stats(),
+        "coalescing": single_flight.stats(),
+        "sseStreams": dict(sse_streams, max=SSE_MAX_STREAMS)
+    }
 
-        # Unique session count per user
-        sessions = 0
-        if messages_collection is not None:
-            sessions = len(messages_collection.distinct("session_id", {"user_id": u["user_id"]}))
+@app.route("/admin/metrics", methods=["GET"])
+def admin_metrics():
+    return jsonify(component_stats())
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    lines = []
+    for histogram in REQUEST_HISTOGRAMS.values():
+        lines.extend(histogram.render())
+    lines += ["# HELP mindmate_requests_total Requests by route and status", "# TYPE mindmate_requests_total counter"]
+    with request_counts_lock:
+        counts = sorted(request_counts.items())
+    lines.extend(f"mindmate_requests_total{{{prometheus_labels(labels)}}} {n}" for labels, n in counts)
+    for component, stats in component_stats().items():
+        if stats: lines.extend(prometheus_gauges(f"mindmate_{re.sub(r'(?<!^)(?=[A-Z])', '_', component).lower()}", stats))
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+@app.route("/admin/profiler", methods=["GET", "POST"])
+@rate_limited("admin")
+def admin_profiler():
+    # POST {"slowMs": 500} turns sampling on for this worker; 0 turns it off
+    if request.method == "POST":
+        slow_ms = (request.json or {}).get("slowMs")
+        if not isinstance(slow_ms, (int, float)) or slow_ms < 0:
+            return jsonify({"error": "slowMs must be a non-negative number"}), 400
+        profiler_settings["slowMs"] = slow_ms
+    return jsonify({"slowMs": profiler_settings["slowMs"], "intervalMs": PROFILE_INTERVAL * 1000, "dumps": profiler_settings["dumps"]})
+
+@app.route("/admin/retention", methods=["GET", "POST"])
+@rate_limited("admin")
+def admin_retention():
+    # POST runs an archive pass now (this worker) instead of waiting for the next interval;
+    # POSTs arriving while one is running wait for it and share its result
+    moved = None
+    if request.method == "POST":
+        if chat_sessions_collection is None: return jsonify({"error": "DB error"}), 500
+        moved = single_flight.do("admin_retention", "archive", archive_cold_conversations)
+    return jsonify({"policies": RETENTION_POLICIES, "codec": ARCHIVE_CODEC, "store": type(archive_store).__name__,
+                    "stats": retention_stats, "moved": moved})
+
+@app.route("/admin/report_data", methods=["GET"])
+@rate_limited("admin")
+@coalesced
+def admin_report_data():
+    if users_collection is None: return jsonify({"error": "DB error"}), 500
+    stats = load_stats()
+    scored = stats.get("scoredUsers", 0)
+    overall_avg = round(stats.get("scoreSum", 0) / scored, 1) if scored else 0
+
+    # Weekly wellness trend from the daily rollups, oldest week first
+    today = datetime.datetime.now(timezone.utc).date()
+    first_day = today - datetime.timedelta(days=7 * REPORT_WEEKS - 1)
+    weeks = [{"checkins": 0, "scoreSum": 0} for _ in range(REPORT_WEEKS)]
+    sessions = set()
+    if activity_collection is not None:
+        for bucket in activity_collection.find({"_id": {"$gte": f"day:{first_day}", "$lte": f"day:{today}"}}):
+            week = (datetime.date.fromisoformat(bucket["_id"][4:]) - first_day).days // 7
+            weeks[week]["checkins"] += bucket.get("checkins", 0)
+            weeks[week]["scoreSum"] += bucket.get("scoreSum", 0)
+            sessions.update(bucket.get("sessions", []))
+
+    trend = []
+    for week in weeks:
+        previous = trend[-1] if trend else overall_avg
+        trend.append(round(week["scoreSum"] / week["checkins"], 1) if week["checkins"] else previous)
+
+    total_users = stats.get("totalUsers", 0)
+    return jsonify({
+        "positiveSentiment": round(100 * stats.get("positiveUsers", 0) / scored) if scored else 0,
+        "avgEngagement": round(len(sessions) / total_users, 1) if total_users else 0,
+        "highRiskCount": stats.get("highRisk", 0),
+        "trend": trend
+    })
 
+@app.route("/admin/wellness/percentiles", methods=["GET"])
+@rate_limited("admin")
+@coalesced
+def admin_wellness_percentiles():
+    if wellness_series_collection is None: return jsonify({"error": "DB error"}), 500
+    days = parse_days(request.args.get("days"), 7)
+    since = datetime.datetime.now(timezone.utc) - datetime.timedelta(days=days)
+    scores = cohort_scores(since)
+
+    result = {
+        "rangeDays": days,
+        "users": len(scores),
+        "percentiles": {f"p{pct}": (round(percentile(scores, pct), 1) if scores else None) for pct in (10, 25, 50, 75, 90)}
+    }
+    # Optional: where one user's window average sits within the cohort
+    user_id = request.args.get("user_id")
+    if user_id:
+        own = cohort_scores(since, {"user_id": user_id})
+        result["user"] = {
+            "user_id": user_id,
+            "avg": round(own[0], 1) if own else None,
+            "percentileRank": round(100 * bisect.bisect_right(scores, own[0]) / len(scores)) if own and scores else None
+        }
+    return jsonify(result)
+
+ADMIN_USERS_BATCH_SIZE = 500
+ADMIN_USER_SORT_FIELDS = {
+    "name": "firstName",
+    "wellnessScore": "wellnessProfile.score",
+    "lastActive": "wellnessProfile.lastUpdate",
+    "created": "created_at"
+}
+RISK_LEVEL_FILTERS = {
+    "high": {"$or": [{"wellnessProfile.score": {"$lt": 50}}, {"wellnessProfile.score": {"$exists": False}}]},
+    "medium": {"wellnessProfile.score": {"$gte": 50, "$lt": 75}},
+    "low": {"wellnessProfile.score": {"$gte": 75}}
+}
+ADMIN_USER_FIELDS = {
+    "_id": 0, "user_id": 1, "firstName": 1, "lastName": 1, "age": 1, "email": 1,
+    "contactNumber": 1, "emergencyContact": 1, "wellnessProfile": 1, "created_at": 1
+}
+
+def risk_level_for(score):
+    if score < 50: return "high"
+    if score < 75: return "medium"
+    return "low"
+
+def session_counts_for(user_ids):
+    # One grouped aggregation over the session summaries for a whole batch of users
+    if chat_sessions_collection is None or not user_ids: return {}
+    pipeline = [
+        {"$match": {"user_id": {"$in": user_ids}}},
+        {"$group": {"_id": "$user_id", "sessions": {"$sum": 1}}}
+    ]
+    return {row["_id"]: row["sessions"] for row in chat_sessions_collection.aggregate(pipeline)}
+
+def format_admin_users(users):
+    sessions = session_counts_for([u["user_id"] for u in users])
+    for u in users:
+        score = u.get("wellnessProfile", {}).get("score", 0)
         last_active = u.get("wellnessProfile", {}).get("lastUpdate") or u.get("created_at")
         if isinstance(last_active, datetime.datetime):
             last_active = last_active.isoformat()
 
-        results.append({
+        yield {
             "id": u["user_id"],
             "name": f"{u.get('firstName', '')} {u.get('lastName', '')}".strip() or "Unknown User",
+            "email": u.get("email"),
+            "contactNumber": u.get("contactNumber"),
+            "emergencyContact": u.get("emergencyContact"),
             "age": u.get("age", "N/A"),
-            "sessions": sessions,
+            "sessions": sessions.get(u["user_id"], 0),
             "screenTime": f"{random.uniform(1.0, 8.0):.1f}h", # Simulated Screen time
-            "riskLevel": risk_level,
+            "riskLevel": risk_level_for(score),
             "wellnessScore": score,
             "lastActive": last_active
-        })
-    return jsonify(results)
+        }
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch: yield batch
+
+def stream_json_array(items):
+    yield "["
+    for i, item in enumerate(items):
+        yield ("," if i else "") + app.json.dumps(item)
+    yield "]"
+
+def admin_users_version():
+    # Counters are bumped on every user/profile/wellness write and when a chat session is created or
+    # deleted. The TTL monitor removes temporary sessions without telling us, so the id of the session
+    # that expires next is part of the version too: it changes as soon as that session is gone.
+    if stats_collection is None: return None
+    stats = stats_collection.find_one({"_id": STATS_DOC_ID}, {"usersVersion": 1, "sessionsVersion": 1}) or {}
+    expiring = None
+    if chat_sessions_collection is not None:
+        expiring = chat_sessions_collection.find_one({"expiresAt": {"$exists": True}}, {"expiresAt": 1}, sort=[("expiresAt", 1)])
+    return stats.get("usersVersion", 0), stats.get("sessionsVersion", 0), expiring and expiring["_id"]
+
+@app.route("/admin/users", methods=["GET"])
+@conditional(admin_users_version)
+@rate_limited("admin")
+def admin_users():
+    if users_collection is None: return jsonify([])
+    query = RISK_LEVEL_FILTERS.get(request.args.get("riskLevel"), {})
+    sort_field = ADMIN_USER_SORT_FIELDS.get(request.args.get("sort"), "_id")
+    direction = -1 if request.args.get("order") == "desc" else 1
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = request.args.get("limit", type=int)
+
+    cursor = users_collection.find(query, ADMIN_USER_FIELDS).sort(sort_field, direction).skip(offset)
+    headers = {}
+    if limit:
+        cursor = cursor.limit(parse_page_size(limit))
+        headers["X-Total-Count"] = str(users_collection.count_documents(query))
+    cursor = cursor.batch_size(ADMIN_USERS_BATCH_SIZE)
+
+    rows = (row for batch in batched(cursor, ADMIN_USERS_BATCH_SIZE) for row in format_admin_users(batch))
+    return Response(stream_json_array(rows), mimetype="application/json", headers=headers)
 
 @app.route("/admin/alerts", methods=["GET"])
+@rate_limited("admin")
+@coalesced
 def admin_alerts():
-    if users_collection is None: return jsonify([])
-    # Generate alerts based on users with extremely low scores
-    high_risk_users = list(users_collection.find({"wellnessProfile.score": {"$lt": 50}}).sort("wellnessProfile.lastUpdate", -1).limit(5))
-    
-    alerts = []
-    for u in high_risk_users:
-        alerts.append({
-            "user": f"{u.get('firstName', '')} {u.get('lastName', '')}",
-            "type": "Low wellness score detected",
-            "time": u.get("wellnessProfile", {}).get("lastUpdate") or datetime.datetime.now(timezone.utc).isoformat(),
-            "severity": "high"
-        })
+    if alerts_collection is None: return jsonify([])
+    # Newest first; `since` returns only alerts raised after the last one the page has seen
+    query = {}
+    if request.args.get("severity"): query["severity"] = request.args.get("severity")
+    since = parse_cursor_time(request.args.get("since"), True)
+    if since: query["createdAt"] = {"$gt": since}
+    limit = parse_page_size(request.args.get("limit") or 10)
+
+    alerts = [format_alert(a) for a in alerts_collection.find(query, {"_id": 0}).sort("createdAt", -1).limit(limit)]
         
     # Mock alerts if db yields empty to show functionality on the frontend
-    if not alerts:
+    if not alerts and not since:
         alerts = [
             {"user": "System Admin", "type": "No immediate alerts", "time": datetime.datetime.now(timezone.utc).isoformat(), "severity": "low"}
         ]
         
     return jsonify(alerts)
 
+@app.route("/admin/alerts/stream", methods=["GET"])
+def stream_admin_alerts():
+    return sse_response(ALERTS_CHANNEL)
+
+# --------------------------------------------------
+#        APP FACTORY / WORKER STARTUP
+# --------------------------------------------------
+BOOT_TIME = time.time()
+BACKGROUND_JOBS = os.getenv("BACKGROUND_JOBS", "1") == "1" # Jobs are leased in Mongo (claim_job); 0 turns them off in this process
+REQUIRED_DEPENDENCIES = ("mongo", "gemini")
+
+worker = {"pid": None}
+worker_lock = threading.Lock()
+warmup_status = {} # dependency -> {"state": pending|ready|failed|disabled, "seconds": ..., "error": ...}
+
+def warm_step(name, fn):
+    warmup_status[name] = {"state": "pending"}
+    started = time.perf_counter()
+    try:
+        state = fn() or "ready"
+        warmup_status[name] = {"state": state, "seconds": round(time.perf_counter() - started, 3)}
+    except Exception as e:
+        print(f"❌ Warm-up of {name} failed:", e)
+        warmup_status[name] = {"state": "failed", "seconds": round(time.perf_counter() - started, 3), "error": str(e)}
+
+def warm_mongo():
+    if db is None: return "disabled"
+    mongo_client.admin.command("ping")
+    print("✅ MongoDB connected")
+    ensure_indexes()
+    init_shared_stores()
+
+def init_shared_stores():
+    # The Mongo-backed broker and rate-limit store create collections and indexes, so they are
+    # built here rather than on the request thread; until then the worker uses the local ones
+    global broker
+    rate_limiter.store = create_rate_limit_store() # First, so a broker failure cannot leave it local
+    previous, broker = broker, create_broker()
+    if broker is not previous: broker.adopt(previous) # Streams opened during warm-up keep receiving
+
+def warm_gemini():
+    init_gemini()
+    return "fake" if FAKE_MODEL else "ready"
+
+def warm_emotion():
+    global emotion_detector
+    emotion_detector = load_emotion_detector()
+    return "ready" if emotion_detector is not None else "disabled"
+
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "3600"))
+
+def claim_job(name, seconds):
+    """Take or renew the fleet-wide lease on a background job; False while another process holds it.
+
+    Every worker on every host starts the same jobs, so each run is gated on this. The holder renews
+    its own lease; anyone else gets it only once it has lapsed (e.g. the holder died).
+    """
+    if jobs_collection is None: return True
+    now = datetime.datetime.now(timezone.utc)
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    try:
+        # A held lease fails the filter, so the upsert collides with the existing _id
+        jobs_collection.update_one(
+            {"_id": name, "$or": [{"leaseUntil": {"$lt": now}}, {"owner": owner}]},
+            {"$set": {"owner": owner, "leaseUntil": now + datetime.timedelta(seconds=seconds), "startedAt": now}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+def backfill_completed(name):
+    # One-off backfills record completion on their job document. "Target collection is not empty" is
+    # no signal: requests served during warm-up write to it before the backfill gets to run.
+    if jobs_collection is None: return False
+    return jobs_collection.find_one({"_id": name, "completedAt": {"$exists": True}}, {"_id": 1}) is not None
+
+def mark_backfill_completed(name):
+    if jobs_collection is None: return
+    jobs_collection.update_one({"_id": name}, {"$set": {"completedAt": datetime.datetime.now(timezone.utc)}}, upsert=True)
+
+def run_backfill(name, job):
+    # Kept for the whole lease after finishing: workers that start later in the same deploy skip it
+    if claim_job(name, JOB_LEASE_SECONDS): job()
+
+def start_background_jobs():
+    backfills = [
+        (chat_sessions_collection, backfill_chat_sessions), (wellness_series_collection, backfill_wellness_series),
+        (users_collection, backfill_search_keys), (alerts_collection, backfill_alerts),
+        (conversations_collection, backfill_conversations), (friendships_collection, migrate_friend_arrays)
+    ]
+    for collection, job in backfills:
+        if collection is not None: threading.Thread(target=run_backfill, args=(job.__name__, job), daemon=True).start()
+    for collection, job in ((stats_collection, run_stats_reconciler), (conversations_collection, run_retention)):
+        if collection is not None: threading.Thread(target=job, daemon=True).start() # Leased per pass
+
+def warm_up():
+    # Slow, non-blocking part of startup; /readyz reports progress
+    for name, fn in (("mongo", warm_mongo), ("gemini", warm_gemini), ("emotion", warm_emotion)):
+        warm_step(name, fn)
+    if BACKGROUND_JOBS: start_background_jobs()
+
+def init_worker(background=True):
+    """Per-process setup, run once in each worker after fork (pid-checked), on its first request.
+
+    Only work that neither blocks nor fails belongs here; anything that talks to a dependency
+    goes in a warm_up() step, where a failure is reported by /readyz instead of raised.
+    """
+    global archive_store
+    if worker["pid"] == os.getpid(): return
+    with worker_lock:
+        if worker["pid"] == os.getpid(): return
+        warmup_status.clear()
+        for name in ("mongo", "gemini", "emotion"): warmup_status[name] = {"state": "pending"}
+        init_mongo()
+        init_memory_store()
+        archive_store = create_archive_store() # Constructors only; no I/O until the first bundle
+        worker["pid"] = os.getpid()
+    if background: threading.Thread(target=warm_up, daemon=True).start()
+    else: warm_up()
+
+@app.before_request
+def ensure_worker_initialized():
+    if request.endpoint == "healthz": return # Liveness must not depend on startup work
+    init_worker()
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify({"status": "ok", "pid": os.getpid(), "uptimeSeconds": round(time.time() - BOOT_TIME, 1)})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    dependencies = {name: dict(status) for name, status in warmup_status.items()}
+    states = [dependencies.get(name, {}).get("state") for name in REQUIRED_DEPENDENCIES]
+    if any(state in ("failed", "disabled") for state in states): status = "failed"
+    elif all(state in ("ready", "fake") for state in states): status = "ready"
+    else: status = "warming"
+    body = {"status": status, "pid": os.getpid(), "uptimeSeconds": round(time.time() - BOOT_TIME, 1), "dependencies": dependencies}
+    return jsonify(body), 200 if status == "ready" else 503
+
+def create_app():
+    """WSGI entry point, e.g. `gunicorn "app:create_app()"`; an alias for the module-level `app`.
+
+    This is not an application factory: routes register on `app` at import, so every call
+    returns the same instance. Nothing is connected at import; each worker initializes itself
+    on its first request (readiness probes included), so preloading the app in the master is safe.
+    """
+    return app
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    create_app().run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
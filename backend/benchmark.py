@@ -0,0 +1,361 @@
+"""Load-test harness for the MindMate backend.
+
+Boots `app` in-process against mongomock (default) or a local mongod, with the fake
+Gemini model, seeds realistic volumes and drives scripted scenarios through the
+Flask test client. Reports p50/p95/p99 latency, requests/second and Mongo ops per
+request, and writes the results as JSON so runs can be compared across commits.
+
+    pip install mongomock   # only needed for the in-memory mode
+    python benchmark.py
+    python benchmark.py --users 50000 --llm-latency 0.8
+    python benchmark.py --mongo-uri mongodb://localhost:27017/?directConnection=true --concurrency 8
+    python benchmark.py --compare bench_results/<old>.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import random
+import argparse
+import datetime
+import tempfile
+import threading
+import subprocess
+from urllib.parse import quote
+from datetime import timezone
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FIRST_NAMES = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+               "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Aarav", "Priya",
+               "Rohan", "Ananya", "Vikram", "Isha", "Arjun", "Meera", "Kabir", "Diya", "Omar", "Fatima"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+              "Sharma", "Patel", "Gupta", "Singh", "Kumar", "Reddy", "Iyer", "Khan", "Das", "Nair"]
+CHAT_LINES = ["hey, how are you?", "I've been feeling a bit stressed about exams", "want to study together later?",
+              "that breathing exercise actually helped", "see you in the group session", "thanks for checking in"]
+AI_PROMPTS = ["I can't sleep before exams", "how do I deal with stress?", "I feel lonely this week",
+              "can you suggest a quick breathing exercise?", "I had a good day today"]
+
+# --------------------------------------------------
+#                  App Boot
+# --------------------------------------------------
+def boot_app(args):
+    os.environ["GEMINI_FAKE_MODEL"] = "1"
+    os.environ["GEMINI_FAKE_LATENCY"] = str(args.llm_latency)
+    os.environ["MEMORY_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="mindmate-bench-"), "memory.db")
+    os.environ["BACKGROUND_JOBS"] = "0" # Seeding fills in derived data itself
+    for name in ("ADMIN", "CHAT", "SEARCH", "EMOTION"):
+        os.environ[f"RATE_LIMIT_{name}"] = "0" # Every simulated user comes from one address
+    os.environ.pop("REALTIME_BROKER", None)
+
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+    else:
+        import mongomock
+        import pymongo
+        os.environ["MONGO_URI"] = "mongodb://benchmark"
+        pymongo.MongoClient = mongomock.MongoClient # Must happen before app imports it
+
+    sys.path.insert(0, BASE_DIR)
+    import app as mindmate
+    mindmate.init_worker(background=False)
+    if not args.mongo_uri: count_mongomock_ops(mindmate)
+    return mindmate
+
+def count_mongomock_ops(mindmate):
+    # mongomock never emits pymongo command events; feed the app's listener by hand
+    from mongomock.collection import Collection
+    listener = mindmate.MongoCommandTimer()
+    methods = ["find", "find_one", "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+               "delete_one", "delete_many", "aggregate", "count_documents", "distinct", "find_one_and_update"]
+
+    def wrap(original):
+        def timed(self, *a, **kw):
+            started = time.perf_counter()
+            try:
+                return original(self, *a, **kw)
+            finally:
+                listener._record((time.perf_counter() - started) * 1e6)
+        return timed
+
+    for name in methods:
+        setattr(Collection, name, wrap(getattr(Collection, name)))
+
+# --------------------------------------------------
+#                  Seeding
+# --------------------------------------------------
+def iso(value):
+    return value.isoformat()
+
+def seed(mindmate, args, rng):
+    started = time.perf_counter()
+    now = datetime.datetime.now(timezone.utc)
+    password = mindmate.generate_password_hash("benchmark") # One hash; hashing per user dominates seeding
+    # Bulk-load without indexes (mongomock checks unique indexes with a scan per insert), then build them
+    for collection in {spec[0].name: spec[0] for spec in mindmate.index_specs()}.values():
+        collection.drop_indexes()
+
+    users = []
+    for i in range(args.users):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        updated = now - datetime.timedelta(hours=rng.randint(0, 24 * 30))
+        user = {
+            "user_id": str(uuid.uuid4()), "firstName": first, "lastName": last,
+            "email": f"{first}.{last}{i}@example.edu".lower(), "age": rng.randint(17, 30),
+            "role": "user", "password": password, "created_at": now - datetime.timedelta(days=rng.randint(1, 365)),
+            "wellnessProfile": {"score": rng.randint(20, 100), "lastUpdate": iso(updated)}
+        }
+        user["searchKeys"] = mindmate.search_keys_for(user)
+        users.append(user)
+    ids = [u["user_id"] for u in users]
+    edges = {}
+    for user_id in ids:
+        for friend_id in rng.sample(ids, min(args.friends, len(ids) - 1)):
+            if friend_id == user_id: continue
+            for a, b in ((user_id, friend_id), (friend_id, user_id)):
+                edges[mindmate.edge_id(a, b)] = {"_id": mindmate.edge_id(a, b), "user_id": a, "friend_id": b, "since": now}
+    insert_batched(mindmate.users_collection, users)
+    insert_batched(mindmate.friendships_collection, list(edges.values()))
+    insert_batched(mindmate.wellness_series_collection, [wellness_bucket(rng, now, u) for u in users])
+
+    # Hot conversations: a few long p2p chats and group chats that the polling scenario reads
+    conversations = []
+    p2p = []
+    for _ in range(args.conversations):
+        a, b = rng.sample(ids, 2)
+        conversations.append((a, b))
+        p2p.extend(chat_history(rng, now, args.messages, {}, lambda m, s: m.update(
+            sender_id=s, receiver_id=b if s == a else a, read=True), [a, b]))
+    insert_batched(mindmate.p2p_messages_collection, p2p)
+
+    groups = []
+    group_messages = []
+    for g in range(args.groups):
+        members = rng.sample(ids, min(args.group_size, len(ids)))
+        group = {"group_id": str(uuid.uuid4()), "name": f"Study circle {g}", "created_by": members[0],
+                 "members": members, "created_at": now - datetime.timedelta(days=30)}
+        groups.append(group)
+        group_messages.extend(chat_history(rng, now, args.messages, {"group_id": group["group_id"]}, lambda m, s: m.update(
+            sender_id=s, sender_name="Member"), members))
+    insert_batched(mindmate.groups_collection, groups)
+    insert_batched(mindmate.group_messages_collection, group_messages)
+
+    mindmate.ensure_indexes()
+
+    # Derived data the app normally maintains on write
+    mindmate.reconcile_stats()
+    mindmate.backfill_alerts()
+
+    print(f"✅ Seeded {len(users)} users, {len(edges)} friend edges, {len(p2p)} p2p and {len(group_messages)} group messages "
+          f"in {time.perf_counter() - started:.1f}s")
+    return {"users": users, "conversations": conversations, "groups": groups}
+
+def wellness_bucket(rng, now, user):
+    # Two weeks of daily check-ins ending at the user's current score
+    samples = [{"t": now - datetime.timedelta(days=14 - d, hours=rng.randint(0, 12)), "s": rng.randint(20, 100)} for d in range(13)]
+    samples.append({"t": now, "s": user["wellnessProfile"]["score"]})
+    return {"user_id": user["user_id"], "count": len(samples), "sum": sum(s["s"] for s in samples),
+            "start": samples[0]["t"], "end": now, "samples": samples}
+
+def chat_history(rng, now, count, base, fill, senders):
+    messages = []
+    for i in range(count):
+        message = dict(base, message_id=str(uuid.uuid4()), text=rng.choice(CHAT_LINES),
+                       timestamp=iso(now - datetime.timedelta(seconds=(count - i) * 30)))
+        fill(message, rng.choice(senders))
+        messages.append(message)
+    return messages
+
+def insert_batched(collection, docs, size=5000):
+    for i in range(0, len(docs), size):
+        collection.insert_many(docs[i:i + size])
+
+# --------------------------------------------------
+#                  Scenarios
+# --------------------------------------------------
+# Each scenario yields (method, path, json body) tuples; one tuple is one timed request.
+def chat_polling(data, rng, count):
+    # Open chat windows poll with a since cursor at the newest message they have
+    since = iso(datetime.datetime.now(timezone.utc) - datetime.timedelta(seconds=60))
+    for i in range(count):
+        if i % 2 and data["groups"]:
+            group = rng.choice(data["groups"])
+            yield "GET", f"/groups/messages/{group['group_id']}?since={quote(since)}", None
+        else:
+            a, b = rng.choice(data["conversations"])
+            yield "POST", "/p2p/messages", {"user_id": a, "friend_id": b, "since": since}
+
+def search_typing(data, rng, count):
+    # One search per keystroke while typing a first name, then the surname
+    sent = 0
+    while sent < count:
+        user, target = rng.choice(data["users"]), rng.choice(data["users"])
+        text = f"{target['firstName']} {target['lastName']}"
+        for end in range(1, len(text) + 1):
+            if sent >= count: return
+            if text[end - 1] == " ": continue
+            sent += 1
+            yield "POST", "/users/search", {"query": text[:end], "user_id": user["user_id"]}
+
+def friend_suggestions(data, rng, count):
+    # Opening the add-friend modal; a returning user hits the per-user suggestion cache
+    for _ in range(count):
+        user = rng.choice(data["users"])
+        yield "GET", f"/friends/suggestions/{user['user_id']}", None
+
+def admin_dashboard(data, rng, count):
+    pages = ["/admin/stats", "/admin/users?limit=50", "/admin/alerts", "/admin/report_data"]
+    for i in range(count):
+        yield "GET", pages[i % len(pages)], None
+
+def ai_chat(data, rng, count):
+    sessions = {}
+    for _ in range(count):
+        user = rng.choice(data["users"][:200]) # Returning users build up history and summaries
+        session_id = sessions.setdefault(user["user_id"], str(uuid.uuid4()))
+        yield "POST", "/chat", {"user_id": user["user_id"], "session_id": session_id, "message": rng.choice(AI_PROMPTS)}
+
+SCENARIOS = {
+    "chat_polling": chat_polling,
+    "search_typing": search_typing,
+    "friend_suggestions": friend_suggestions,
+    "admin_dashboard": admin_dashboard,
+    "ai_chat": ai_chat
+}
+# mongomock copies the whole collection for every aggregate, so these only run there when asked for
+MONGOD_ONLY = {"friend_suggestions"}
+
+# --------------------------------------------------
+#                  Driver
+# --------------------------------------------------
+def percentile(sorted_values, pct):
+    if not sorted_values: return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))]
+
+def mongo_op_totals(mindmate):
+    totals = mindmate.REQUEST_HISTOGRAMS["mongoOps"].totals()
+    return sum(total for total, _ in totals.values()), sum(count for _, count in totals.values())
+
+def run_scenario(mindmate, name, requests, concurrency):
+    pending = queue.Queue()
+    for item in requests: pending.put(item)
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker():
+        client = mindmate.app.test_client()
+        while True:
+            try:
+                method, path, body = pending.get_nowait()
+            except queue.Empty:
+                return
+            started = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            response.get_data()
+            response.close() # Closing runs the app's per-request metrics hook
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    ops_before, count_before = mongo_op_totals(mindmate)
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - started
+    ops_after, count_after = mongo_op_totals(mindmate)
+
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    result = {
+        "requests": len(latencies),
+        "errors": sum(n for status, n in statuses.items() if status >= 400),
+        # Latencies of rejected or failed requests measure the wrong code path
+        "valid": all(200 <= status < 300 for status in statuses),
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "rps": round(len(latencies) / wall, 1) if wall else None,
+        "p50Ms": ms(percentile(latencies, 50)),
+        "p95Ms": ms(percentile(latencies, 95)),
+        "p99Ms": ms(percentile(latencies, 99)),
+        "meanMs": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "dbOpsPerRequest": round((ops_after - ops_before) / (count_after - count_before), 1) if count_after > count_before else None
+    }
+    print(f"  {name:<16} {result['requests']:>6} req  {result['rps']:>8} rps  p50 {result['p50Ms']:>8}ms  "
+          f"p95 {result['p95Ms']:>8}ms  p99 {result['p99Ms']:>8}ms  {result['dbOpsPerRequest']} db ops/req  "
+          f"{result['errors']} errors" + ("" if result["valid"] else f"  INVALID (statuses {result['statuses']})"))
+    return result
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, text=True).strip()
+    except Exception:
+        return "unknown"
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline.get('revision')} ({baseline_path}):")
+    for name, result in current["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old: continue
+        if not result["valid"] or old.get("valid") is False:
+            print(f"  {name:<16} skipped: non-2xx responses in one of the runs")
+            continue
+        changes = []
+        for key in ("p50Ms", "p95Ms", "p99Ms", "rps", "dbOpsPerRequest"):
+            if old.get(key) and result.get(key) is not None:
+                changes.append(f"{key} {100 * (result[key] - old[key]) / old[key]:+.0f}%")
+        print(f"  {name:<16} " + "  ".join(changes))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", help="Use a real mongod (its database is seeded into; use a scratch instance)")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--friends", type=int, help="Friends picked per user, about twice this once mutual "
+                        "(default 150 on mongod, 5 on mongomock, which scans every edge per query)")
+    parser.add_argument("--conversations", type=int, default=50, help="Hot p2p conversations")
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--group-size", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=2000, help="Messages per conversation/group")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Fake model latency in seconds")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="Worker threads (mongod only; mongomock runs serially)")
+    parser.add_argument("--scenarios", help="Comma-separated subset to run (default: all that suit the backend)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Result file (default bench_results/<revision>-<time>.json)")
+    parser.add_argument("--compare", help="Earlier result file to diff against")
+    args = parser.parse_args()
+
+    if not args.mongo_uri: args.concurrency = 1 # mongomock is not thread-safe
+    if args.friends is None: args.friends = 150 if args.mongo_uri else 5
+    if not args.scenarios: args.scenarios = ",".join(n for n in SCENARIOS if args.mongo_uri or n not in MONGOD_ONLY)
+    rng = random.Random(args.seed)
+    mindmate = boot_app(args)
+    data = seed(mindmate, args, rng)
+
+    results = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now(timezone.utc).isoformat(),
+        "backend": "mongod" if args.mongo_uri else "mongomock",
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "mongo_uri")},
+        "scenarios": {}
+    }
+    print(f"Running with concurrency {args.concurrency}:")
+    for name in args.scenarios.split(","):
+        requests = list(SCENARIOS[name](data, rng, args.requests))
+        results["scenarios"][name] = run_scenario(mindmate, name, requests, args.concurrency)
+
+    output = args.output or os.path.join(BASE_DIR, "bench_results", f"{results['revision']}-{time.strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Results written to {output}")
+
+    if args.compare: compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
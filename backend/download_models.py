@@ -0,0 +1,102 @@
+"""Fetch the ONNX models used by /detect_emotion into backend/models/.
+
+    python download_models.py            # download anything missing, verify everything
+    python download_models.py --force    # re-download
+
+Sources (both MIT licensed):
+  face_detection_yunet_2023mar.onnx  https://github.com/opencv/opencv_zoo/tree/main/models/face_detection_yunet
+  emotion-ferplus-8.onnx             https://github.com/onnx/models/tree/main/validated/vision/body_analysis/emotion_ferplus
+
+Every file must match the SHA-256 pinned in MODELS and load in OpenCV; anything else is deleted
+and the script exits non-zero. The URLs point at branches that can move, so the pin is what
+decides. A model without a pin is refused; --allow-unpinned downloads it anyway and prints its
+hash so it can be reviewed and added to MODELS.
+"""
+import os
+import sys
+import hashlib
+import argparse
+import urllib.request
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(BASE_DIR, "models")
+
+# sha256: lowercase hex of the reviewed file. When changing a model, update its URL and hash together.
+MODELS = {
+    "face_detection_yunet_2023mar.onnx": {
+        "url": "https://github.com/opencv/opencv_zoo/raw/main/models/face_detection_yunet/face_detection_yunet_2023mar.onnx",
+        "sha256": None
+    },
+    "emotion-ferplus-8.onnx": {
+        "url": "https://github.com/onnx/models/raw/main/validated/vision/body_analysis/emotion_ferplus/model/emotion-ferplus-8.onnx",
+        "sha256": None
+    }
+}
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def loads_in_opencv(name, path):
+    try:
+        import cv2
+    except ImportError:
+        print("  (opencv-python-headless not installed; skipped the load check)")
+        return True
+    try:
+        if name.startswith("face_detection_yunet"): cv2.FaceDetectorYN.create(path, "", (320, 240))
+        else: cv2.dnn.readNetFromONNX(path)
+        return True
+    except Exception as e:
+        print(f"  ❌ OpenCV could not load {name}: {e}")
+        return False
+
+def fetch(name, url, path):
+    # Git LFS files: the raw URL redirects to the real object; an LFS pointer means the redirect failed
+    tmp = path + ".part"
+    print(f"⬇️  {name} <- {url}")
+    urllib.request.urlretrieve(url, tmp)
+    with open(tmp, "rb") as f:
+        if f.read(64).startswith(b"version https://git-lfs"):
+            os.remove(tmp)
+            raise RuntimeError("got a Git LFS pointer instead of the model")
+    os.replace(tmp, path)
+
+def verify(name, spec, path, allow_unpinned):
+    digest = sha256(path)
+    if spec["sha256"] is None:
+        print(f"  ⚠️ {name} has no pinned SHA-256 (got {digest}); review the file and add it to MODELS")
+        if not allow_unpinned: return False
+    elif digest != spec["sha256"]:
+        print(f"  ❌ {name}: SHA-256 {digest} does not match the pinned {spec['sha256']}")
+        return False
+    if not loads_in_opencv(name, path): return False
+    print(f"✅ {name}  sha256 {digest}")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--force", action="store_true", help="Download even if the file exists")
+    parser.add_argument("--allow-unpinned", action="store_true", help="Keep models that have no pinned hash yet")
+    args = parser.parse_args()
+
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    ok = True
+    for name, spec in MODELS.items():
+        path = os.path.join(MODELS_DIR, name)
+        try:
+            if args.force or not os.path.exists(path): fetch(name, spec["url"], path)
+        except Exception as e:
+            print(f"  ❌ Download failed: {e}")
+            ok = False
+            continue
+        if not verify(name, spec, path, args.allow_unpinned):
+            os.remove(path) # Never leave an unverified model where the app would load it
+            ok = False
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app reads its configuration at import: no database, fake model, no background work
+os.environ.pop("MONGO_URI", None)
+os.environ["GEMINI_FAKE_MODEL"] = "1"
+os.environ["GEMINI_FAKE_LATENCY"] = "0"
+os.environ["BACKGROUND_JOBS"] = "0"
+os.environ["MEMORY_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="mindmate-tests-"), "memory.db")
+os.environ["RATE_LIMIT_CHAT"] = "0"
+os.environ["RATE_LIMIT_ADMIN"] = "0" # Admin tests replay many requests from one address
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as mindmate  # noqa: E402
+
+
+@pytest.fixture
+def app_module():
+    mindmate.init_worker(background=False)
+    return mindmate
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def mongo(app_module, monkeypatch):
+    # In-memory MongoDB; the module globals are restored afterwards
+    mongomock = pytest.importorskip("mongomock")
+    for name in [n for n in dir(app_module) if n.endswith("_collection")] + ["db", "mongo_client"]:
+        monkeypatch.setattr(app_module, name, getattr(app_module, name))
+    monkeypatch.setattr(app_module, "MongoClient", lambda uri, event_listeners=None, **options: mongomock.MongoClient())
+    monkeypatch.setenv("MONGO_URI", "mongodb://tests")
+    app_module.init_mongo()
+    return app_module.db
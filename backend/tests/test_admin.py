@@ -0,0 +1,60 @@
+import datetime
+from datetime import timezone
+
+
+def admin_users(client, etag=None):
+    headers = {"If-None-Match": etag} if etag else {}
+    response = client.get("/admin/users", headers=headers)
+    response.close()
+    return response
+
+
+def test_admin_users_etag_changes_when_sessions_go_away(app_module, client, mongo):
+    now = datetime.datetime.now(timezone.utc)
+    app_module.users_collection.insert_one({"user_id": "u1", "firstName": "Ada", "lastName": "L"})
+    app_module.touch_chat_session("u1", "s1", "hello", now, 1)
+    app_module.touch_chat_session("u1", "s2", "hi", now, 1, expires_at=now + datetime.timedelta(hours=1))
+
+    etag = admin_users(client).headers["ETag"]
+    assert admin_users(client, etag).status_code == 304
+
+    assert client.delete("/sessions/s1").status_code == 200
+    response = admin_users(client, etag)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    # What the TTL monitor does once a temporary chat expires: no counter is bumped
+    app_module.chat_sessions_collection.delete_one({"session_id": "s2"})
+    assert admin_users(client, etag).status_code == 200
+
+
+def test_concurrent_retention_posts_share_one_archive_pass(app_module, client, mongo, monkeypatch):
+    import threading
+    import time
+
+    passes = []
+    def slow_pass():
+        passes.append(1)
+        time.sleep(0.2)
+        return {"p2p": 3}
+    monkeypatch.setattr(app_module, "archive_cold_conversations", slow_pass)
+
+    results = []
+    def post():
+        response = app_module.app.test_client().post("/admin/retention")
+        results.append((response.status_code, response.get_json()["moved"]))
+    threads = [threading.Thread(target=post) for _ in range(3)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    assert len(passes) == 1
+    assert results == [(200, {"p2p": 3})] * 3
+
+
+def test_retention_and_profiler_are_rate_limited(app_module, client, monkeypatch):
+    monkeypatch.setitem(app_module.RATE_LIMITS, "admin", (1, 1e-9))
+    monkeypatch.setattr(app_module.rate_limiter, "store", app_module.LocalBucketStore())
+    for path in ("/admin/retention", "/admin/profiler"):
+        assert client.get(path).status_code == 200
+        assert client.get(path).status_code == 429
+        monkeypatch.setattr(app_module.rate_limiter, "store", app_module.LocalBucketStore())
@@ -0,0 +1,27 @@
+import datetime
+from datetime import timezone
+
+
+def check_in(client, user_id, score):
+    response = client.put(f"/wellness/{user_id}", json={"score": score})
+    assert response.status_code == 200
+    response.close()
+
+
+def test_sharp_drop_is_judged_against_earlier_check_ins(app_module, client, mongo):
+    app_module.users_collection.insert_one({"user_id": "u1", "firstName": "Ada", "lastName": "L"})
+    check_in(client, "u1", 80)
+    check_in(client, "u1", 55) # 25 points below the single earlier check-in
+
+    rules = [a["rule"] for a in app_module.alerts_collection.find({"user_id": "u1"})]
+    assert rules == ["sharp_drop"]
+
+
+def test_small_dip_raises_nothing(app_module, client, mongo):
+    app_module.users_collection.insert_one({"user_id": "u2", "firstName": "Bo", "lastName": "K"})
+    check_in(client, "u2", 80)
+    check_in(client, "u2", 70)
+
+    assert app_module.alerts_collection.count_documents({"user_id": "u2"}) == 0
+    since = datetime.datetime.now(timezone.utc) - datetime.timedelta(days=1)
+    assert app_module.window_average("u2", since) == (75, 2)
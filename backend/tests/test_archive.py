@@ -0,0 +1,24 @@
+import pytest
+
+
+def test_bundle_keys_do_not_carry_client_ids(app_module):
+    key, _, _ = app_module.archive_target("ai_chat", {"user_id": "../../etc", "session_id": "x/../../passwd"})
+    kind, name = key.split("/")
+    assert kind == "ai_chat" and len(name) == 64
+
+    # The separator keeps ("a_b", "c") and ("a", "b_c") apart
+    first = app_module.archive_key("ai_chat", "a_b", "c")
+    assert first != app_module.archive_key("ai_chat", "a", "b_c")
+
+
+def test_disk_store_refuses_keys_outside_its_root(app_module, tmp_path):
+    store = app_module.DiskArchiveStore(str(tmp_path / "archive"))
+    store.put("p2p/abc", b"bundle")
+    assert store.get("p2p/abc") == b"bundle"
+
+    for key in ("../outside", "p2p/../../outside", ""):
+        with pytest.raises(ValueError):
+            store.get(key)
+    with pytest.raises(ValueError):
+        store.delete("../../etc/passwd")
+    assert not (tmp_path / "outside").exists()
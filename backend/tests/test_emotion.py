@@ -0,0 +1,33 @@
+import base64
+
+import pytest
+
+
+class RecordingDetector:
+    def __init__(self):
+        self.frames = []
+
+    def detect(self, image_bytes, stream_key):
+        self.frames.append(image_bytes)
+        return {"emotion": "neutral"}
+
+
+@pytest.fixture
+def detector(app_module, monkeypatch):
+    fake = RecordingDetector()
+    monkeypatch.setattr(app_module, "emotion_detector", fake)
+    return fake
+
+
+@pytest.mark.parametrize("image", ["data:image/jpeg;base64,abc", "abcde", 12345])
+def test_malformed_images_are_client_errors(client, detector, image):
+    response = client.post("/detect_emotion", json={"image": image, "user_id": "u1"})
+    assert response.status_code == 400
+    assert detector.frames == []
+
+
+def test_data_urls_are_decoded(client, detector):
+    payload = "data:image/jpeg;base64," + base64.b64encode(b"\xff\xd8jpeg").decode()
+    response = client.post("/detect_emotion", json={"image": payload, "user_id": "u1"})
+    assert response.status_code == 200
+    assert detector.frames == [b"\xff\xd8jpeg"]
@@ -0,0 +1,47 @@
+import datetime
+import uuid
+from datetime import timezone
+
+
+def history(client, session_id, **params):
+    response = client.get(f"/history/{session_id}", query_string=params)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_history_cursors_round_trip(app_module, client, mongo):
+    start = datetime.datetime(2026, 3, 1, 12, 0, 0, 250000, tzinfo=timezone.utc)
+    app_module.messages_collection.insert_many([{
+        "message_id": str(uuid.uuid4()), "user_id": "u1", "session_id": "s1", "sender": "user",
+        "message": f"m{i}", "timestamp": start + datetime.timedelta(milliseconds=300 * i)
+    } for i in range(4)])
+
+    page = history(client, "s1")
+    assert [m["message"] for m in page] == ["m0", "m1", "m2", "m3"]
+    last = page[-1]
+    assert history(client, "s1", since=last["timestamp"], since_id=last["message_id"]) == []
+    older = history(client, "s1", before=last["timestamp"], before_id=last["message_id"])
+    assert [m["message"] for m in older] == ["m0", "m1", "m2"]
+
+
+def test_legacy_messages_page_by_timestamp_alone(app_module, client, mongo):
+    start = datetime.datetime(2025, 1, 1, tzinfo=timezone.utc)
+    app_module.messages_collection.insert_many([{
+        "user_id": "u1", "session_id": "old", "sender": "ai", "message": f"m{i}",
+        "timestamp": start + datetime.timedelta(milliseconds=10 * i)
+    } for i in range(3)])
+
+    first = history(client, "old")[0]
+    assert [m["message"] for m in history(client, "old", since=first["timestamp"])] == ["m1", "m2"]
+
+
+def test_unparseable_cursors_are_ignored(app_module, client, mongo):
+    app_module.messages_collection.insert_one({
+        "message_id": "m", "user_id": "u1", "session_id": "s1", "sender": "user", "message": "hi",
+        "timestamp": datetime.datetime.now(timezone.utc)
+    })
+    assert [m["message"] for m in history(client, "s1", since="garbage")] == ["hi"]
+    for path in ("/sessions/u1?before=garbage", "/admin/alerts?since=garbage"):
+        response = client.get(path)
+        assert response.status_code == 200
+        response.close()
@@ -0,0 +1,57 @@
+import datetime
+from datetime import timezone
+
+
+def test_one_process_holds_a_job_lease_until_it_lapses(app_module, mongo, monkeypatch):
+    assert app_module.claim_job("reconcile", 60)
+    assert app_module.claim_job("reconcile", 60) # The holder renews
+
+    monkeypatch.setattr(app_module.socket, "gethostname", lambda: "other-host")
+    assert not app_module.claim_job("reconcile", 60)
+
+    past = datetime.datetime.now(timezone.utc) - datetime.timedelta(seconds=1)
+    app_module.jobs_collection.update_one({"_id": "reconcile"}, {"$set": {"leaseUntil": past}})
+    assert app_module.claim_job("reconcile", 60)
+
+
+def test_backfills_do_not_duplicate_when_runs_overlap(app_module, mongo, monkeypatch):
+    app_module.ensure_indexes()
+    app_module.users_collection.insert_one({
+        "user_id": "u1", "firstName": "Ada", "lastName": "L",
+        "wellnessProfile": {"score": 30, "lastUpdate": "2026-01-01T00:00:00+00:00"}
+    })
+    # Two workers that start together both pass the "nothing seeded yet" checks
+    monkeypatch.setattr(app_module.alerts_collection, "find_one", lambda *args, **kwargs: None)
+    monkeypatch.setattr(app_module.wellness_series_collection, "distinct", lambda *args, **kwargs: [])
+    for _ in range(2):
+        app_module.backfill_alerts()
+        app_module.backfill_wellness_series()
+
+    assert app_module.alerts_collection.count_documents({"user_id": "u1"}) == 1
+    assert app_module.wellness_series_collection.count_documents({"user_id": "u1"}) == 1
+
+
+def test_chat_session_backfill_runs_after_new_sessions_appear(app_module, client, mongo):
+    legacy = datetime.datetime(2025, 5, 1, tzinfo=timezone.utc)
+    app_module.messages_collection.insert_one({"user_id": "u1", "session_id": "old", "sender": "user", "message": "hi", "timestamp": legacy})
+    # A chat served during warm-up, before the backfill got its turn
+    app_module.touch_chat_session("u1", "new", "hello", datetime.datetime.now(timezone.utc), 1)
+
+    app_module.backfill_chat_sessions()
+    response = client.get("/sessions/u1")
+    assert {s["session_id"] for s in response.get_json()} == {"old", "new"}
+    assert app_module.backfill_completed("backfill_chat_sessions")
+
+
+def test_conversation_backfill_runs_after_new_conversations_appear(app_module, mongo):
+    app_module.p2p_messages_collection.insert_one({
+        "message_id": "m1", "sender_id": "a", "receiver_id": "b", "text": "hi",
+        "timestamp": "2025-05-01T00:00:00+00:00", "read": False
+    })
+    # A message sent during warm-up, before the backfill got its turn
+    sent = {"message_id": "m2", "sender_id": "c", "text": "yo", "timestamp": "2026-01-01T00:00:00+00:00"}
+    app_module.touch_conversation(app_module.p2p_channel("c", "d"), "p2p", ["c", "d"], sent)
+
+    app_module.backfill_conversations()
+    legacy = app_module.conversations_collection.find_one({"_id": app_module.p2p_channel("a", "b")})
+    assert legacy["message_count"] == 1 and legacy["unread"] == {"b": 1}
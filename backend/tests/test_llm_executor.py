@@ -0,0 +1,128 @@
+import json
+import threading
+import time
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def model_latency(app_module, monkeypatch):
+    def set_latency(seconds):
+        monkeypatch.setattr(app_module, "FAKE_MODEL_LATENCY", seconds)
+    return set_latency
+
+
+@pytest.fixture
+def executor(app_module, monkeypatch):
+    # A small executor per test so limits are easy to reach
+    def make(max_workers=1, max_queue=0, max_per_user=2, timeout=5):
+        small = app_module.LLMExecutor(max_workers, max_queue, max_per_user, timeout)
+        monkeypatch.setattr(app_module, "llm_executor", small)
+        return small
+    return make
+
+
+def user():
+    return f"test-{uuid.uuid4()}"  # Fresh persona/model cache entry, so the current latency applies
+
+
+def chat(client, user_id, message="hello"):
+    response = client.post("/chat", json={"message": message, "user_id": user_id})
+    body = response.get_json()
+    response.close()
+    return response.status_code, body
+
+
+def in_background(app_module, user_id):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(chat(app_module.app.test_client(), user_id)))
+    thread.start()
+    return thread, results
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+def test_chat_replies_through_fake_model(client, model_latency):
+    model_latency(0)
+    status, body = chat(client, user(), "hi there")
+    assert status == 200
+    assert body["reply"] == "I hear you. You said: hi there"
+
+
+def test_full_queue_returns_503(app_module, client, executor, model_latency):
+    small = executor(max_workers=1, max_queue=0)
+    model_latency(0.5)
+    thread, results = in_background(app_module, user())
+    wait_for(lambda: small.stats()["running"] == 1)
+
+    status, body = chat(client, user())
+    thread.join()
+
+    assert status == 503
+    assert "busy" in body["error"]
+    assert results[0][0] == 200
+    assert small.stats()["rejectedBusy"] == 1
+
+
+def test_second_concurrent_request_from_same_user_returns_429(app_module, client, executor, model_latency):
+    small = executor(max_workers=2, max_queue=2, max_per_user=1)
+    model_latency(0.5)
+    user_id = user()
+    thread, results = in_background(app_module, user_id)
+    wait_for(lambda: small.stats()["admitted"] == 1)
+
+    status, _ = chat(client, user_id)
+    thread.join()
+
+    assert status == 429
+    assert results[0][0] == 200
+    assert small.stats()["rejectedUser"] == 1
+
+
+def test_slow_model_returns_504(client, executor, model_latency):
+    small = executor(timeout=0.1)
+    model_latency(0.5)
+
+    status, body = chat(client, user())
+
+    assert status == 504
+    assert small.stats()["timeouts"] == 1
+
+
+def test_slot_is_released_after_timeout(client, executor, model_latency):
+    small = executor(max_workers=1, max_queue=0, timeout=0.1)
+    model_latency(0.3)
+    user_id = user()
+    assert chat(client, user_id)[0] == 504
+
+    # The timed-out call keeps its slot until the model actually returns, then frees it
+    wait_for(lambda: small.stats()["admitted"] == 0)
+    assert small.stats()["running"] == 0
+    model_latency(0)
+    assert chat(client, user())[0] == 200
+
+
+def test_stream_relays_chunks(client, executor, model_latency):
+    executor(max_workers=1, max_queue=0)
+    model_latency(0.05)
+
+    response = client.post("/chat/stream", json={"message": "how are you", "user_id": user()})
+    frames = [frame for frame in response.get_data(as_text=True).split("\n\n") if frame]
+    response.close()
+
+    events = []
+    for frame in frames:
+        lines = dict(line.split(": ", 1) for line in frame.split("\n"))
+        events.append((lines.get("event", "message"), json.loads(lines["data"])))
+    deltas = [data["delta"] for event, data in events if event == "message"]
+
+    assert events[0][0] == "session"
+    assert len(deltas) > 1
+    assert events[-1][0] == "done"
+    assert events[-1][1]["reply"] == "".join(deltas) == "I hear you. You said: how are you"
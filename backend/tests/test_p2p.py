@@ -0,0 +1,12 @@
+def test_p2p_routes_reject_missing_ids_before_writing(app_module, client, mongo):
+    response = client.post("/p2p/messages", json={"user_id": "a"})
+    assert response.status_code == 400
+
+    response = client.post("/p2p/send", json={"sender_id": "a", "text": "hi"})
+    assert response.status_code == 400
+    assert app_module.p2p_messages_collection.count_documents({}) == 0
+
+    response = client.post("/p2p/send", json={"sender_id": "a", "receiver_id": "b", "text": "hi"})
+    assert response.status_code == 200
+    messages = client.post("/p2p/messages", json={"user_id": "b", "friend_id": "a"}).get_json()
+    assert [m["text"] for m in messages] == ["hi"]
@@ -0,0 +1,46 @@
+import pytest
+
+
+@pytest.fixture
+def search_limit(app_module, monkeypatch):
+    # Two searches per user, eight per address, no refill during the test
+    monkeypatch.setitem(app_module.RATE_LIMITS, "search", (2, 1e-9))
+    monkeypatch.setattr(app_module, "RATE_LIMIT_ADDRESS_FACTOR", 4)
+    monkeypatch.setattr(app_module.rate_limiter, "store", app_module.LocalBucketStore())
+
+
+def search(client, user_id=None, address="127.0.0.1", **headers):
+    body = {"query": "ada"}
+    if user_id: body["user_id"] = user_id
+    response = client.post("/users/search", json=body, headers=headers, environ_base={"REMOTE_ADDR": address})
+    return response.status_code
+
+
+def test_each_user_has_a_bucket(client, search_limit):
+    assert [search(client, "u1") for _ in range(3)] == [200, 200, 429]
+    assert search(client, "u2") == 200
+
+
+def test_rotating_user_ids_still_hits_the_address_bucket(client, search_limit):
+    codes = [search(client, f"u{i}") for i in range(9)]
+    assert codes == [200] * 8 + [429]
+
+
+def test_forwarded_for_is_ignored_without_trusted_proxies(client, search_limit):
+    codes = [search(client, **{"X-Forwarded-For": f"10.0.0.{i}"}) for i in range(3)]
+    assert codes == [200, 200, 429]
+
+
+def test_guests_are_limited_per_address_not_as_one_user(client, search_limit):
+    codes = [search(client, "Guest", address=f"10.0.0.{i}") for i in range(12)]
+    assert codes == [200] * 12
+    assert [search(client, "guest", address="10.0.0.1") for _ in range(2)] == [200, 429]
+
+
+def test_guest_reply_slots_are_per_address(app_module):
+    owners = set()
+    for address in ("10.0.0.1", "10.0.0.2"):
+        with app_module.app.test_request_context(environ_base={"REMOTE_ADDR": address}):
+            owners.add(app_module.llm_slot_owner("Guest"))
+            assert app_module.llm_slot_owner("u1") == "u1"
+    assert owners == {"ip:10.0.0.1", "ip:10.0.0.2"}
@@ -0,0 +1,52 @@
+import pytest
+
+
+def test_streams_beyond_the_cap_get_503_until_one_closes(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, "SSE_MAX_STREAMS", 1)
+    first = client.get("/groups/stream/g1", buffered=False)
+    assert first.status_code == 200
+    assert next(first.response) == b"retry: 3000\n\n"
+
+    refused = client.get("/groups/stream/g1", buffered=False)
+    assert refused.status_code == 503
+    assert refused.headers["Retry-After"] == "30"
+    refused.close()
+
+    first.close()
+    assert app_module.sse_streams["open"] == 0
+    again = client.get("/groups/stream/g1", buffered=False)
+    assert again.status_code == 200
+    again.close()
+    assert app_module.sse_streams["open"] == 0
+
+
+def test_streams_opened_during_warm_up_survive_the_broker_swap(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "broker", app_module.LocalBroker())
+    q = app_module.broker.subscribe("group:g1")
+
+    replacement = app_module.LocalBroker()
+    monkeypatch.setattr(app_module, "create_broker", lambda: replacement)
+    app_module.init_shared_stores()
+
+    assert app_module.broker is replacement
+    app_module.broker.publish("group:g1", {"text": "hi"})
+    assert q.get_nowait() == {"text": "hi"}
+    app_module.broker.unsubscribe("group:g1", q)
+
+
+def test_mongo_broker_tolerates_a_worker_creating_its_collection_first(app_module, mongo, monkeypatch):
+    from pymongo.errors import CollectionInvalid, OperationFailure
+
+    monkeypatch.setattr(mongo, "list_collection_names", lambda *args, **kwargs: []) # Checked before the other worker
+    for error in (CollectionInvalid("collection realtime_events already exists"),
+                  OperationFailure("Collection already exists", code=48)):
+        def create_collection(*args, **kwargs):
+            raise error
+        monkeypatch.setattr(mongo, "create_collection", create_collection)
+        app_module.MongoBroker(mongo)
+
+    def unauthorized(*args, **kwargs):
+        raise OperationFailure("not authorized", code=13)
+    monkeypatch.setattr(mongo, "create_collection", unauthorized)
+    with pytest.raises(OperationFailure):
+        app_module.MongoBroker(mongo)
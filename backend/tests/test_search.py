@@ -0,0 +1,11 @@
+def test_offset_pages_cover_every_match_once(app_module, client, mongo):
+    for i in range(7):
+        user = {"user_id": f"u{i}", "firstName": "Ada", "lastName": f"Lovelace{i}", "email": f"ada{i}@x.org"}
+        user["searchKeys"] = app_module.search_keys_for(user)
+        app_module.users_collection.insert_one(user)
+
+    seen = []
+    for offset in range(0, 8, 3):
+        page = client.post("/users/search", json={"query": "ada", "user_id": "me", "limit": 3, "offset": offset}).get_json()
+        seen += [u["user_id"] for u in page]
+    assert sorted(seen) == [f"u{i}" for i in range(7)]
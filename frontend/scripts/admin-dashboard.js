@@ -22,6 +22,7 @@ async function initializeAdminDashboard() {
   await fetchDashboardStats();
   await loadUserMonitoringData();
   await loadRecentAlerts();
+  subscribeToAlerts();
 }
 
 // --------------------------------------------------
@@ -154,6 +155,16 @@ async function loadRecentAlerts() {
     }
 }
 
+// New alerts are pushed by the backend as they are raised; refresh the list on each one
+function subscribeToAlerts() {
+    const poll = () => setInterval(loadRecentAlerts, 30000);
+    if (!window.EventSource) return poll();
+    const stream = new EventSource(`${API_BASE_URL}/admin/alerts/stream`);
+    stream.onmessage = () => loadRecentAlerts();
+    // The server refuses streams when it is at its connection limit; poll instead
+    stream.onerror = () => { if (stream.readyState === EventSource.CLOSED) poll(); };
+}
+
 // --------------------------------------------------
 // UI Details and Actions
 // --------------------------------------------------
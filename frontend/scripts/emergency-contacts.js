@@ -1,6 +1,14 @@
 document.addEventListener('DOMContentLoaded', function() {
     // Fetch live alerts from the backend
     fetchLiveAlerts();
+    if (window.EventSource) {
+        const stream = new EventSource(`${API_BASE_URL}/admin/alerts/stream`);
+        stream.onmessage = () => fetchLiveAlerts();
+        // Refused at the server's connection limit: poll instead
+        stream.onerror = () => { if (stream.readyState === EventSource.CLOSED) setInterval(fetchLiveAlerts, 30000); };
+    } else {
+        setInterval(fetchLiveAlerts, 30000);
+    }
     
     // Fetch live users to populate the Guardian Directory
     fetchLiveContacts();